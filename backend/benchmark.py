@@ -0,0 +1,423 @@
+"""
+Load and latency benchmark for every route of the trivia API.
+
+Seeds a synthetic question bank (1k, 100k or 1m questions) into SQLite
+or Postgres, drives each endpoint in process through the Flask test
+client, over a local threaded WSGI server or over a uvicorn worker
+(flaskr.asgi, async engine), and reports p50/p95/p99 latency and
+throughput per scenario. With --baseline the run fails (exit code 1)
+when a scenario got slower than the stored baseline, or when the
+baseline has no entry for the size, mode and concurrency of the run.
+bench_baseline.json holds the default run (1k, in process).
+
+    python benchmark.py --size 100k
+    python benchmark.py --size 100k --server --concurrency 8
+    python benchmark.py --size 100k --asgi --concurrency 64
+    python benchmark.py --size 100k --save-baseline bench_baseline.json
+    python benchmark.py --size 100k --baseline bench_baseline.json
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import multiprocessing
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from flaskr import create_app, init_db, QUESTIONS_PER_PAGE
+from flaskr.snapshot import question_snapshot
+from models import db, Question, Category
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+SEED_BATCH_SIZE = 10000
+VOCABULARY_SIZE = 2000
+# a slower p95 than baseline * (1 + tolerance) is a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def make_vocabulary(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 9)))
+            for _ in range(VOCABULARY_SIZE)]
+
+
+def seed(app, size, rng):
+    """Fills the database with size synthetic questions, unless it already has them."""
+    with app.app_context():
+        init_db()
+        if db.session.query(func.count(Question.id)).scalar() == size:
+            return
+        db.session.query(Question).delete()
+        db.session.query(Category).delete()
+        db.session.commit()
+        db.session.execute(insert(Category), [{'type': name} for name in CATEGORIES])
+        category_ids = [category.id for category in Category.query.all()]
+        vocabulary = make_vocabulary(rng)
+        for start in range(0, size, SEED_BATCH_SIZE):
+            rows = []
+            for _ in range(min(SEED_BATCH_SIZE, size - start)):
+                words = rng.sample(vocabulary, rng.randint(6, 14))
+                rows.append({
+                    'question': 'Which ' + ' '.join(words) + '?',
+                    'answer': ' '.join(rng.sample(vocabulary, rng.randint(1, 3))),
+                    'difficulty': rng.randint(1, 5),
+                    'category': rng.choice(category_ids),
+                })
+            db.session.execute(insert(Question), rows)
+        db.session.commit()
+
+
+class InProcessClient:
+    """In process requests through the Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        response = self.client.open(path, method=method, data=body, content_type=content_type)
+        return response.status_code, response.get_data()
+
+
+class ServerClient:
+    """Requests over HTTP to a local WSGI server, one keep-alive connection per thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        connection = self.local.connection
+        headers = {'Content-Type': content_type} if body is not None else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def simulate_latency(seconds):
+    """
+    Every statement waits seconds more, like a database across the
+    network. A sync request holds its thread meanwhile, an async one
+    (flaskr.asgi) yields to the other requests of the event loop.
+    """
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def wait(connection, cursor, statement, parameters, context, executemany):
+        if in_greenlet():
+            await_only(asyncio.sleep(seconds))
+        else:
+            time.sleep(seconds)
+
+
+def serving_app(database, snapshot, latency):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database, 'QUESTION_SNAPSHOT': snapshot})
+    app.logger.setLevel('ERROR')
+    if latency:
+        simulate_latency(latency)
+    return app
+
+
+def serve_wsgi(listener, database, snapshot, latency):
+    server = make_server('127.0.0.1', 0, serving_app(database, snapshot, latency), threaded=True,
+                         request_handler=QuietRequestHandler, fd=listener.fileno())
+    server.serve_forever()
+
+
+def serve_asgi(listener, database, snapshot, latency):
+    import uvicorn
+    from flaskr.asgi import AsyncTrivia, create_engine_for
+
+    app = serving_app(database, snapshot, latency)
+    asgi = AsyncTrivia(app, create_engine_for(app.config, database))
+    uvicorn.Server(uvicorn.Config(asgi, log_level='warning', access_log=False)).run(sockets=[listener])
+
+
+class ServerProcess:
+    """
+    A local server in a child process (one worker), so the load generator
+    threads don't compete with it for the GIL.
+    """
+
+    def __init__(self, serve, database, snapshot=False, latency=0):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # inherited by the accepted sockets, small responses aren't held back by Nagle
+        self.listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        # connections wait in the backlog until the child accepts them
+        self.listener.listen(2048)
+        self.server_port = self.listener.getsockname()[1]
+        self.process = multiprocessing.get_context('fork').Process(
+            target=serve, args=(self.listener, database, snapshot, latency), daemon=True)
+        self.process.start()
+
+    def shutdown(self):
+        self.process.terminate()
+        self.process.join()
+        self.listener.close()
+
+
+class Scenarios:
+    """Each scenario makes the requests of one operation and returns nothing."""
+
+    def __init__(self, app, client, rng):
+        self.app = app
+        self.client = client
+        self.rng = rng
+        with app.app_context():
+            self.total = db.session.query(func.count(Question.id)).scalar()
+            self.max_id = db.session.query(func.max(Question.id)).scalar() or 0
+            self.category_ids = [category.id for category in Category.query.all()]
+            words = [row.question.split()[1] for row in Question.query.limit(200)]
+        self.words = words or ['which']
+        self.created = []
+        self.lock = threading.Lock()
+
+    def call(self, method, path, body=None, content_type='application/json', expect=(200,)):
+        status, data = self.client.request(method, path, body, content_type)
+        if status not in expect:
+            raise RuntimeError('{} {} returned {}'.format(method, path, status))
+        return data
+
+    def base_url(self):
+        self.call('GET', '/api')
+
+    def categories(self):
+        self.call('GET', '/api/categories')
+
+    def questions_first_page(self):
+        self.call('GET', '/api/questions?page=1')
+
+    def questions_deep_page(self):
+        last_page = max(1, (self.total + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE)
+        self.call('GET', '/api/questions?page={}'.format(last_page))
+
+    def questions_deep_cursor(self):
+        after = max(0, self.max_id - 2 * QUESTIONS_PER_PAGE)
+        self.call('GET', '/api/questions?after={}'.format(after))
+
+    def category_questions(self):
+        category = self.rng.choice(self.category_ids)
+        self.call('GET', '/api/categories/{}/questions'.format(category))
+
+    def search(self):
+        self.call('POST', '/api/questions', {'searchTerm': self.rng.choice(self.words)})
+
+    def search_empty_term(self):
+        self.call('POST', '/api/questions', {'searchTerm': ''})
+
+    def quiz_play(self):
+        # a whole 5 question game the way the frontend plays it
+        category = {'id': self.rng.choice(self.category_ids + [0])}
+        previous = []
+        for _ in range(5):
+            data = json.loads(self.call('POST', '/api/quizzes', {
+                'previous_questions': previous, 'quiz_category': category}))
+            if not data['question']:
+                break
+            previous.append(data['question']['id'])
+
+    def quiz_session(self):
+        category = {'id': self.rng.choice(self.category_ids + [0])}
+        data = json.loads(self.call('POST', '/api/quizzes/sessions', {'quiz_category': category}))
+        for _ in range(data['total_questions']):
+            self.call('POST', '/api/quizzes/sessions/{}/next'.format(data['token']))
+
+    def create_question(self):
+        self.call('POST', '/api/questions', {
+            'question': 'Which benchmark question is this?', 'answer': 'This one',
+            'difficulty': 1, 'category': self.rng.choice(self.category_ids)})
+
+    def delete_question(self):
+        # deletes the questions create_question added, one each time
+        with self.lock:
+            if not self.created:
+                # from the database, a snapshot (--snapshot) may not have them yet
+                with self.app.app_context():
+                    self.created = db.session.scalars(
+                        select(Question.id).where(Question.id > self.max_id).limit(100)).all()
+            question_id = self.created.pop() if self.created else None
+        if question_id is None:
+            self.create_question()
+            return self.delete_question()
+        self.call('DELETE', '/api/questions/{}'.format(question_id))
+
+    def import_questions(self):
+        lines = [json.dumps({'question': 'Which imported question is this?', 'answer': 'Imported',
+                             'difficulty': 1, 'category': self.rng.choice(self.category_ids)})
+                 for _ in range(100)]
+        self.call('POST', '/api/questions/import', '\n'.join(lines), 'application/x-ndjson')
+
+    def export_category(self):
+        category = self.rng.choice(self.category_ids)
+        self.call('GET', '/api/questions/export?difficulty=5&category={}'.format(category))
+
+
+# scenario name and the share of --requests it runs, slow bulk operations run less often
+SCENARIOS = [
+    ('base_url', 1),
+    ('categories', 1),
+    ('questions_first_page', 1),
+    ('questions_deep_page', 1),
+    ('questions_deep_cursor', 1),
+    ('category_questions', 1),
+    ('search', 1),
+    ('search_empty_term', 1),
+    ('quiz_play', 0.5),
+    ('quiz_session', 0.5),
+    ('create_question', 0.5),
+    ('delete_question', 0.5),
+    ('import_questions', 0.05),
+    ('export_category', 0.05),
+]
+
+
+def percentile(samples, percent):
+    # nearest rank percentile of sorted samples
+    index = max(0, math.ceil(percent / 100.0 * len(samples)) - 1)
+    return samples[min(index, len(samples) - 1)]
+
+
+def run_scenario(scenario, requests, concurrency, warmup):
+    for _ in range(warmup):
+        scenario()
+    latencies = []
+
+    def timed(_):
+        started = time.perf_counter()
+        scenario()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = list(pool.map(timed, range(requests)))
+    else:
+        latencies = [timed(i) for i in range(requests)]
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput': round(requests / elapsed, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected and result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {}ms, baseline {}ms'.format(
+                name, result['p95_ms'], expected['p95_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', choices=SIZES, default='1k')
+    parser.add_argument('--database', help='database url, defaults to sqlite:///bench_<size>.db')
+    parser.add_argument('--server', action='store_true', help='go through a local threaded WSGI server')
+    parser.add_argument('--asgi', action='store_true', help='go through a local uvicorn worker and the async engine')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--db-latency', type=float, default=0,
+                        help='milliseconds added to every statement of the server, like a remote database')
+    parser.add_argument('--snapshot', action='store_true', help='serve reads from the in-memory snapshot')
+    parser.add_argument('--only', action='append', help='run only this scenario, repeatable')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', help='fail when slower than this baseline file')
+    parser.add_argument('--save-baseline', help='store the results in this baseline file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    database = args.database or 'sqlite:///' + os.path.abspath('bench_{}.db'.format(args.size))
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database})
+    seed(app, SIZES[args.size], rng)
+    if args.snapshot:
+        # loaded after seeding, the seed doesn't go through the commit listeners
+        app.config['QUESTION_SNAPSHOT'] = True
+        question_snapshot.init_app(app)
+
+    server = None
+    if args.db_latency and not (args.asgi or args.server):
+        simulate_latency(args.db_latency / 1000)
+    if args.asgi or args.server:
+        server = ServerProcess(serve_asgi if args.asgi else serve_wsgi, database, args.snapshot, args.db_latency / 1000)
+        client = ServerClient(server.server_port)
+    else:
+        client = InProcessClient(app)
+    scenarios = Scenarios(app, client, rng)
+
+    results = {}
+    print('{:<24}{:>10}{:>10}{:>10}{:>12}'.format('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, share in SCENARIOS:
+        if args.only and name not in args.only:
+            continue
+        requests = max(1, int(args.requests * share))
+        result = run_scenario(getattr(scenarios, name), requests, args.concurrency,
+                              min(args.warmup, requests))
+        results[name] = result
+        print('{:<24}{:>10}{:>10}{:>10}{:>12}'.format(
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput']))
+    if server is not None:
+        server.shutdown()
+
+    # a baseline file keeps one set of results per size, mode and concurrency
+    mode = 'asgi' if args.asgi else 'server' if args.server else 'inprocess'
+    key = '{}-{}-c{}'.format(args.size, mode, args.concurrency)
+    if args.snapshot:
+        key += '-snapshot'
+    if args.db_latency:
+        key += '-latency{:g}ms'.format(args.db_latency)
+    if args.save_baseline:
+        baselines = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline) as baseline_file:
+                baselines = json.load(baseline_file)
+        baselines[key] = results
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file).get(key, {})
+        if not baseline:
+            # a size, mode or concurrency the baseline wasn't saved for must not pass silently
+            print('\nno baseline for {} in {}, save one with --save-baseline'.format(key, args.baseline))
+            return 1
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('\nregressions against {}:'.format(args.baseline))
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,29 +3,110 @@ from multiprocessing import current_process
 import os
 from unicodedata import category
 from unittest import result
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, Response, request, abort, jsonify, stream_with_context, g, send_file
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import setup_db, database_path, replica_path, replica_reads, REPLICA, db, Question
+from schema import upgrade
+from flaskr.cache import category_cache, search_cache
+from flaskr.search import question_search
+from flaskr.quiz import question_index
+from flaskr.counts import question_counts
+from flaskr.snapshot import question_snapshot, SnapshotListing
+from flaskr.suggest import suggest_index, SUGGEST_LIMIT, MAX_SUGGEST_LIMIT
+from flaskr.quiz_sessions import quiz_sessions
+from flaskr.bulk import (import_questions, apply_batch, IMPORT_BATCH_SIZE, IMPORT_FORMATS,
+                         MAX_BATCH_OPERATIONS)
+from flaskr.export import export_questions, EXPORT_FORMATS
+from flaskr.http_cache import conditional
+from flaskr.compression import response_cache, compressed, request_key
+from flaskr.metrics import metrics
+from flaskr.profiler import profiler
+from flaskr.reads import (QUESTION_FIELDS, QUESTION_SORTS, question_fields, question_query,
+                          question_rows, project, json_response)
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+# questions in a quiz game
+QUIZ_QUESTIONS = 5
 
 
-def paginated_questions(request, questions):
+def paginated_questions(request, query, fields=QUESTION_FIELDS):
+    # let the database apply LIMIT/OFFSET instead of slicing the whole table
     page = request.args.get("page", 1, type=int)
+    if page < 1:
+        return []
     start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    thequestions = [question.format() for question in questions]
-    current_questions = thequestions[start:end]
-    return current_questions
+    if isinstance(query, SnapshotListing):
+        return query.rows(start, QUESTIONS_PER_PAGE, fields)
+    return question_rows(query.offset(start).limit(QUESTIONS_PER_PAGE), fields)
+
+
+def cursor_questions(request, query, fields=QUESTION_FIELDS, descending=False):
+    # keyset pagination: ?after=<id>&limit=N, every page costs the same as the first
+    after = request.args.get("after", None, type=int)
+    limit = request.args.get("limit", QUESTIONS_PER_PAGE, type=int)
+    # only called with ?after=, a cursor that isn't an id is a bad request
+    if after is None or limit < 1 or limit > MAX_QUESTIONS_PER_PAGE:
+        abort(400)
+    # the cursor needs the ids even when they are not projected
+    columns = fields if 'id' in fields else tuple(sorted(fields + ('id',)))
+    # fetch one extra row to know if there is a next page
+    if isinstance(query, SnapshotListing):
+        questions = query.after(after, limit + 1, columns)
+    else:
+        if after is not None:
+            query = query.where(Question.id < after if descending else Question.id > after)
+        questions = question_rows(query.limit(limit + 1), columns)
+    next_cursor = None
+    if len(questions) > limit:
+        questions = questions[:limit]
+        next_cursor = questions[-1]['id']
+    return project(questions, fields), next_cursor
+
+
+def category_exists(category_id):
+    snapshot = question_snapshot.get()
+    return category_id in (category_cache.get() if snapshot is None else snapshot.categories)
+
+
+def count_questions():
+    return question_counts.total()
+
+
+def init_db():
+    """
+    Creates the missing tables, applies the pending migrations and builds
+    the search index. Run once per deploy with flask init-db, starting
+    the app doesn't touch the schema.
+    """
+    db.create_all()
+    applied = upgrade(db.engine)
+    question_search.create_index()
+    return applied
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     with app.app_context():
-        setup_db(app)
+        setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path),
+                 app.config.get('SQLALCHEMY_REPLICA_URI', replica_path))
+    category_cache.init_app(app)
+    search_cache.init_app(app)
+    response_cache.init_app(app)
+    question_search.init_app(app)
+    question_index.init_app(app)
+    question_counts.init_app(app)
+    question_snapshot.init_app(app)
+    suggest_index.init_app(app)
+    quiz_sessions.init_app(app)
 
     """
     @TODO: Set up CORS. Allow '*' for origins.
@@ -43,6 +124,70 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,PATCH,DELETE,OPTIONS')
         return response
 
+    # GET routes only read, their SELECTs may go to the replica (see RoutingSession)
+    @app.before_request
+    def readFromReplica():
+        if request.method in ('GET', 'HEAD'):
+            g.read_replica = True
+
+    metrics.init_app(app)
+    metrics.collect('trivia_category_cache_hits_total', 'counter',
+                    'Category map reads served from the cache.', lambda: category_cache.hits)
+    metrics.collect('trivia_category_cache_misses_total', 'counter',
+                    'Category map reads that queried the database.', lambda: category_cache.misses)
+    metrics.collect('trivia_search_cache_hits_total', 'counter',
+                    'Search pages served from the cache.', lambda: search_cache.hits)
+    metrics.collect('trivia_search_cache_misses_total', 'counter',
+                    'Search pages that queried the database.', lambda: search_cache.misses)
+    metrics.collect('trivia_search_cache_evictions_total', 'counter',
+                    'Search pages dropped for the size or memory bound.', lambda: search_cache.evictions)
+    metrics.collect('trivia_search_cache_entries', 'gauge',
+                    'Search pages in the cache.', lambda: len(search_cache))
+    metrics.collect('trivia_search_cache_bytes', 'gauge',
+                    'Estimated memory used by the cached search pages.', lambda: search_cache.nbytes)
+    metrics.collect('trivia_response_cache_hits_total', 'counter',
+                    'Read responses sent from the encoded body cache.', lambda: response_cache.hits)
+    metrics.collect('trivia_response_cache_misses_total', 'counter',
+                    'Read responses built, serialized and compressed.', lambda: response_cache.misses)
+    metrics.collect('trivia_response_cache_evictions_total', 'counter',
+                    'Encoded bodies dropped for the size or memory bound.', lambda: response_cache.evictions)
+    metrics.collect('trivia_response_cache_bytes', 'gauge',
+                    'Memory used by the encoded bodies in the cache.', lambda: response_cache.nbytes)
+    metrics.collect('trivia_snapshot_rebuilds_total', 'counter',
+                    'Question snapshots built (QUESTION_SNAPSHOT mode).', lambda: question_snapshot.rebuilds)
+    metrics.collect('trivia_snapshot_rebuild_seconds', 'gauge',
+                    'Time the last question snapshot took to build.', lambda: question_snapshot.rebuild_seconds)
+
+    @app.route('/api/metrics')
+    def getMetrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    # profiles requests only when PROFILER_TOKEN or PROFILE_ENDPOINTS is set
+    profiler.init_app(app)
+
+    def checkProfilerToken():
+        # the reports hold SQL parameters, they are only served with the token
+        if not profiler.token:
+            abort(404)
+        if not profiler.authorized():
+            abort(401)
+
+    @app.route('/api/profiles')
+    def getProfiles():
+        checkProfilerToken()
+        return jsonify({
+            'success': True,
+            'profiles': profiler.reports()
+        })
+
+    @app.route('/api/profiles/<reportId>')
+    def downloadProfile(reportId):
+        checkProfilerToken()
+        path = profiler.path(reportId)
+        if path is None:
+            abort(404)
+        return send_file(path, mimetype='text/plain', as_attachment=True, download_name=reportId + '.txt')
+
     # endpoint for base url
     @app.route('/api')
     def api_endpoint():
@@ -65,15 +210,18 @@ def create_app(test_config=None):
     for all available categories.
     """
     @app.route('/api/categories')
+    @conditional
     def getCategories():
-        categories = {}
-        results = Category.query.all()
-        for category in results:
-            categories[category.id] = category.type
-        return jsonify({
+        snapshot = question_snapshot.get()
+        response = {
             'success': True,
-            'categories': categories
-        })
+            'categories': category_cache.get() if snapshot is None else snapshot.categories
+        }
+        if request.args.get('with_counts', type=int):
+            # questions per category, from the in-memory counters
+            totals = question_counts.by_category() if snapshot is None else snapshot.counts()
+            response['counts'] = {categoryId: totals.get(categoryId, 0) for categoryId in response['categories']}
+        return json_response(response)
     """
     @TODO:
     Create an endpoint to handle GET requests for questions,
@@ -88,24 +236,65 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     """
     @app.route('/api/questions')
+    @conditional
+    @compressed
     def getPaginatedQuestions():
-        questions = Question.query.order_by(Question.id).all()
-        paginated = paginated_questions(request, questions)
+        fields = question_fields(request)
+        snapshot = question_snapshot.get()
+        questions = question_query() if snapshot is None else snapshot.listing()
+        next_cursor = None
+        if 'after' in request.args:
+            paginated, next_cursor = cursor_questions(request, questions, fields)
+        else:
+            paginated = paginated_questions(request, questions, fields)
         if len(paginated) == 0:
             abort(404)
 
-        categories = Category.query.order_by(Category.id).all()
-        results = {}
-        for category in categories:
-            results[category.id] = category.type
-
-        return jsonify({
+        response = {
             'success': True,
             'questions': paginated,
-            'total_questions': len(Question.query.all()),
-            'categories': results,
+            'total_questions': count_questions() if snapshot is None else len(snapshot),
+            'categories': category_cache.get() if snapshot is None else snapshot.categories,
             'current_category': '',
-        })    
+        }
+        if 'after' in request.args:
+            response['next_cursor'] = next_cursor
+        return json_response(response)
+
+    @app.route('/api/questions/suggest')
+    @conditional
+    def suggestQuestions():
+        # typeahead, answered from the in-memory word index without a query
+        query = request.args.get('q', '')
+        limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+        if not query.strip() or limit < 1 or limit > MAX_SUGGEST_LIMIT:
+            abort(400)
+
+        return json_response({
+            'success': True,
+            'suggestions': suggest_index.suggest(query, limit),
+        })
+
+    @app.route('/api/questions/export')
+    def exportQuestions():
+        # stream the whole bank, memory stays flat however big the table is
+        format = request.args.get('format', 'ndjson')
+        if format not in EXPORT_FORMATS:
+            abort(400)
+        category = request.args.get('category', None, type=int)
+        difficulty = request.args.get('difficulty', None, type=int)
+        # 'gzip;q=0' is in accept_encodings too, it refuses gzip
+        gzip = request.accept_encodings.best_match(('gzip',)) is not None
+
+        snapshot = question_snapshot.get()
+        rows = None if snapshot is None else snapshot.export_rows(category, difficulty)
+        body = export_questions(format, category, difficulty, gzip, rows)
+        response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[format])
+        response.headers['Content-Disposition'] = 'attachment; filename=questions.' + format
+        if gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
 
     """
     @TODO:
@@ -117,16 +306,33 @@ def create_app(test_config=None):
     """
     @app.route('/api/questions/<int:question_id>', methods=['DELETE'])
     def deleteQuestion(question_id):
+        question = db.session.get(Question, question_id)
+        if question is None:
+            abort(422)
         try:
-            question = Question.query.get(question_id)
             question.delete()
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
 
-            return jsonify({
-                'success': True
-            })
-        except:
+        return jsonify({
+            'success': True
+        })
+
+    @app.route('/api/questions/batch', methods=['POST'])
+    def batchQuestions():
+        # many deletes and updates, one transaction and one round trip
+        body = request.get_json(silent=True)
+        operations = body.get('operations') if isinstance(body, dict) else None
+        if not isinstance(operations, list) or not operations or len(operations) > MAX_BATCH_OPERATIONS:
+            abort(400)
+
+        try:
+            report = apply_batch(operations)
+        except SQLAlchemyError:
             abort(422)
-            
+
+        return jsonify(dict(report, success=True))
 
     """
     @TODO:
@@ -162,31 +368,44 @@ def create_app(test_config=None):
         questionCategory = body.get('category', None)
 
         searchTerm = body.get('searchTerm', None)
+        if isinstance(searchTerm, str):
+            # 'world  cup ' searches the same as 'world cup'
+            searchTerm = ' '.join(searchTerm.split())
+        fields = question_fields(request)
+        snapshot = question_snapshot.get()
         try:
             if searchTerm:
-                # take title
-                title = searchTerm
-                # filter all question with that title
-                filteredQuestions = Question.query.filter(Question.question.ilike('%' + title + '%')).all()
+                # ranked search through the full-text index, one page at a time
+                page = request.args.get('page', 1, type=int)
+                filteredQuestions, total = [], 0
+                if page > 0:
+                    filteredQuestions, total = search_cache.get(
+                        searchTerm,
+                        limit=QUESTIONS_PER_PAGE,
+                        offset=(page - 1) * QUESTIONS_PER_PAGE,
+                        answers=bool(body.get('searchAnswers', False)),
+                        search=question_search.search if snapshot is None else snapshot.search)
                 # return 'success', 'questions', 'total_questions', 'current_category'
-                return jsonify({
+                return json_response({
                     'success': True,
-                    'questions': [filteredQuestion.format() for filteredQuestion in filteredQuestions],
-                    'total_questions': len(filteredQuestions),
+                    'questions': project(filteredQuestions, fields),
+                    'total_questions': total,
                     'current_category': 'All',
                 })
             elif searchTerm == '':
-                # take title
-                title = searchTerm
-                # filter all question with that title
-                filteredQuestions = Question.query.filter(Question.question.ilike('%' + title + '%')).all()
-                # return 'success', 'questions', 'total_questions', 'current_category'
-                return jsonify({
-                    'success': True,
-                    'questions': [filteredQuestion.format() for filteredQuestion in filteredQuestions],
-                    'total_questions': len(filteredQuestions),
-                    'current_category': '',
-                })
+                # an empty search term matches everything, paginate it like GET /api/questions
+                def emptySearch():
+                    questions = question_query() if snapshot is None else snapshot.listing()
+                    filteredQuestions = paginated_questions(request, questions, fields)
+                    # return 'success', 'questions', 'total_questions', 'current_category'
+                    return json_response({
+                        'success': True,
+                        'questions': filteredQuestions,
+                        'total_questions': count_questions() if snapshot is None else len(snapshot),
+                        'current_category': '',
+                    })
+                # the body only says "everything", the page and fields are in the query string
+                return response_cache.respond(('searchTerm=',) + request_key(), emptySearch)
             elif questionCategory and theQuestion and questionAnswer:
                 question = Question(question=theQuestion,answer=questionAnswer,category=questionCategory,difficulty=questionDifficulty)
                 question.insert()
@@ -198,6 +417,48 @@ def create_app(test_config=None):
                 abort(422)
         except:
             abort(422)
+    @app.route('/api/questions/import', methods=['POST'])
+    def importQuestions():
+        # NDJSON or CSV body, read as a stream: only one batch of questions is in memory at a time
+        format = request.args.get('format')
+        if format is None:
+            format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        batchSize = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+        if format not in IMPORT_FORMATS or batchSize < 1:
+            abort(400)
+
+        try:
+            report = import_questions(request.stream, format, batchSize)
+        except UnicodeDecodeError:
+            abort(400)
+        except SQLAlchemyError:
+            abort(422)
+
+        return jsonify(dict(report, success=True))
+
+    @app.cli.command('init-db')
+    def initDbCommand():
+        """Create the tables, indexes and search index."""
+        applied = init_db()
+        click.echo('database ready, {} migration(s) applied'.format(len(applied)))
+
+    @app.cli.command('import-questions')
+    @click.argument('file', type=click.File('rb'))
+    @click.option('--format', type=click.Choice(IMPORT_FORMATS), default=None,
+                  help='defaults to csv for .csv files, ndjson otherwise')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+    def importQuestionsCommand(file, format, batch_size):
+        """Import questions from an NDJSON or CSV file."""
+        if format is None:
+            format = 'csv' if file.name.endswith('.csv') else 'ndjson'
+        try:
+            report = import_questions(file, format, batch_size)
+        except UnicodeDecodeError as error:
+            raise click.ClickException('{} is not utf-8: {}'.format(file.name, error.reason))
+        click.echo('inserted {inserted}, failed {failed}'.format(**report))
+        for error in report['errors']:
+            click.echo('line {line}: {error}'.format(**error), err=True)
+
     """
     @TODO:
     Create a GET endpoint to get questions based on category.
@@ -207,21 +468,49 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/api/categories/<int:category_id>/questions')
+    @conditional(exists=category_exists)
+    @compressed
     def getQuestionsByCategory(category_id):
+        fields = question_fields(request)
+        snapshot = question_snapshot.get()
         # get specific category 
-        try:
-            category = Category.query.filter_by(id=category_id).one_or_none()
-            # get all question's of that category
-            questions = category.questions
-            # return json object
-            return jsonify({
-                'success': True,
-                'total_questions': len(questions),
-                'current_category': category_id,
-                'questions': [question.format() for question in questions]
-            })
-        except:
+        if not category_exists(category_id):
             abort(404)
+
+        # filter, sort and paginate in SQL, served by the (category, ...) indexes
+        difficulty = request.args.get('difficulty', None, type=int)
+        if 'difficulty' in request.args and difficulty is None:
+            abort(400)
+        sort = request.args.get('sort', 'id')
+        if sort not in QUESTION_SORTS:
+            abort(400)
+        if snapshot is not None:
+            questions = snapshot.listing(category_id, difficulty, sort)
+        else:
+            questions = select(Question.id).where(Question.category == category_id)
+            if difficulty is not None:
+                questions = questions.where(Question.difficulty == difficulty)
+            questions = questions.order_by(*QUESTION_SORTS[sort])
+
+        next_cursor = None
+        if 'after' in request.args:
+            # the cursor is an id, it only works when sorting by id
+            if sort not in ('id', '-id'):
+                abort(400)
+            paginated, next_cursor = cursor_questions(request, questions, fields, sort == '-id')
+        else:
+            paginated = paginated_questions(request, questions, fields)
+
+        response = {
+            'success': True,
+            'total_questions': question_counts.total(category_id, difficulty) if snapshot is None else len(questions),
+            'current_category': category_id,
+            'questions': paginated
+        }
+        if 'after' in request.args:
+            response['next_cursor'] = next_cursor
+        return json_response(response)
+
     """
     @TODO:
     Create a POST endpoint to get questions to play the quiz.
@@ -234,30 +523,37 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
 
-    def random_question(quizCategory, previousQuestions):
-        allQuestions = None
-        firstQuestion = None
-        currentQuestion = None
-        # if quiz category equal to 0, then get all questions that is not in previous qestions
-        if quizCategory == 0:
-            allQuestions = Question.query.filter(Question.id.notin_(previousQuestions)).all()
-        # if previous questions equal to zero, then get first question prior to specific category
-        elif previousQuestions == 0:
-            firstQuestion = Question.query.filter(Question.category==quizCategory).first()
-            allQuestions = list(firstQuestion)
-        else:
-            allQuestions = Question.query.filter(Question.id.notin_(previousQuestions), Question.category==quizCategory).all()
-        
-        questions = [question.format() for question in allQuestions]
-
-        randomMax = len(questions)
-        # get random question if randomMax more than zero
-        if randomMax > 0:
-            currentQuestion = questions[random.randint(0, randomMax-1)]
-        else:
-            currentQuestion = False
-
-        return currentQuestion
+    def random_questions(quizCategory, seen, count):
+        # sample ids not in seen from the in-memory index, load them in one query
+        snapshot = question_snapshot.get()
+        questions = []
+        skipped = []
+        while len(questions) < count:
+            questionIds = question_index.sample_many(
+                quizCategory, seen, count - len(questions), [question['id'] for question in questions] + skipped)
+            if not questionIds:
+                break
+            if snapshot is not None:
+                rows = {row['id']: row for row in snapshot.by_ids(questionIds)}
+            else:
+                # sampling only reads, the replica can answer it
+                with replica_reads():
+                    rows = {row['id']: row for row in question_rows(
+                        question_query().where(Question.id.in_(questionIds)))}
+            for questionId in questionIds:
+                if questionId in rows:
+                    questions.append(rows[questionId])
+                elif snapshot is not None or REPLICA in db.engines:
+                    # written after the snapshot was taken, or not replicated yet
+                    skipped.append(questionId)
+                else:
+                    # deleted by another process since the index was built
+                    question_index.remove(questionId)
+        return questions
+
+    def random_question(quizCategory, seen):
+        questions = random_questions(quizCategory, seen, 1)
+        return questions[0] if questions else False
 
     @app.route('/api/quizzes', methods=['POST'])
     def getNextQuestion():
@@ -265,33 +561,73 @@ def create_app(test_config=None):
         body = request.get_json()
         previousQuestions = body.get('previous_questions', None)
         quizCategory = body.get('quiz_category', None)
+        count = body.get('count', None)
         # if quiz category is none, then abort
         if quizCategory is None:
             abort(404)
-        # get the id of category
-        categoryNumber = quizCategory['id']
-
-        total_questions = 5
-        # if category is all (0), set total_questions to 5
-        if categoryNumber != 0:
-            # get all questions based on its category
-            allQuestions = Question.query.filter(Question.category==categoryNumber).all()
-            listQuestions = [question.format() for question in allQuestions]
-            # if number of questions less than 5, then set total_questions to the total all questions
-            if len(listQuestions) < 5:
-                total_questions = len(listQuestions)
-            # if number of questions more than 5, then set total_questions to 5
-            else: 
-                total_questions = 5
-
-        # take a random question
-        question = random_question(categoryNumber, previousQuestions)
+        # get the id of category, the frontend sends it as a string
+        try:
+            categoryNumber = int(quizCategory['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+        if count is not None and (not isinstance(count, int) or not 1 <= count <= QUIZ_QUESTIONS):
+            abort(400)
+
+        seen = set(previousQuestions or [])
+        response = {
+            'success': True,
+            'previous': previousQuestions,
+            'total_questions': quiz_total_questions(categoryNumber)
+        }
+        if count is None:
+            # take a random question
+            response['question'] = random_question(categoryNumber, seen)
+        else:
+            # prefetch: the rest of the game in one request
+            questions = random_questions(categoryNumber, seen, count)
+            response['questions'] = questions
+            response['question'] = questions[0] if questions else False
+        return jsonify(response)
+
+    def quiz_total_questions(quizCategory):
+        # if category is all (0), set total_questions to QUIZ_QUESTIONS
+        if quizCategory == 0:
+            return QUIZ_QUESTIONS
+        # at most QUIZ_QUESTIONS questions, fewer if the category is smaller
+        return min(question_index.size(quizCategory), QUIZ_QUESTIONS)
+
+    @app.route('/api/quizzes/sessions', methods=['POST'])
+    def startQuiz():
+        body = request.get_json()
+        quizCategory = body.get('quiz_category', None)
+        if quizCategory is None:
+            abort(404)
+        try:
+            categoryNumber = int(quizCategory['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'token': quiz_sessions.create(categoryNumber),
+            'total_questions': quiz_total_questions(categoryNumber)
+        })
+
+    @app.route('/api/quizzes/sessions/<token>/next', methods=['POST'])
+    def getNextSessionQuestion(token):
+        # the server remembers the asked questions, the client only sends the token
+        session = quiz_sessions.get(token)
+        if session is None:
+            abort(404)
+
+        question = random_question(session.category, session.seen)
+        if question:
+            quiz_sessions.add_seen(token, question['id'])
 
         return jsonify({
             'success': True,
             'question': question,
-            'previous': previousQuestions,
-            'total_questions': total_questions
+            'total_questions': quiz_total_questions(session.category)
         })
 
 
@@ -308,6 +644,14 @@ def create_app(test_config=None):
             'error': 400
         }), 400
         
+    @app.errorhandler(401)
+    def unauthorized(error):
+        return jsonify({
+            'success': False,
+            'message': 'unauthorized',
+            'error': 401
+        }), 401
+
     @app.errorhandler(404)
     def notFound(error):
         return jsonify({
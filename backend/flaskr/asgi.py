@@ -0,0 +1,204 @@
+"""
+ASGI entry point, serving the same Flask app with an async database layer:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 2
+
+Needs SQLAlchemy's asyncio extra and an async driver: asyncpg for
+Postgres, aiosqlite for SQLite (see requirements.txt).
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from flaskr import create_app
+from models import db, REPLICA, PRIMARY, TimedQueuePool, pool_options, replica_statement
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+# threads for the routes that stream (their generators can't await)
+ASGI_THREADS = 8
+THREADED_PATHS = ('/api/questions/export', '/api/questions/import')
+
+
+def async_database_url(path):
+    """The URL of the async driver for the database of path."""
+    url = make_url(path)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError('no async driver for {}'.format(url.get_backend_name()))
+    if url.drivername == driver:
+        return url
+    return url.set(drivername=driver)
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """TimedQueuePool for the async engines, checkouts are reported the same way."""
+
+
+def create_engine_for(config, path, name=PRIMARY):
+    url = async_database_url(path)
+    options = pool_options(config, url, name)
+    if options.get('poolclass') is TimedQueuePool:
+        options['poolclass'] = TimedAsyncQueuePool
+    return create_async_engine(url, **options)
+
+
+class AsyncRoutingSession(Session):
+    """The sync side of the AsyncSessions, reads go to the replica like models.RoutingSession."""
+
+    def __init__(self, replica=None, **kwargs):
+        super().__init__(**kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self.replica is not None and bind is None and replica_statement(self, clause):
+            return self.replica.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ of an ASGI http scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        # WSGI strings are bytes decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_wsgi(app, environ, emit):
+    """Runs the WSGI app and passes the ASGI response messages to emit."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+
+    body = app(environ, start_response)
+    try:
+        emit({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        for chunk in body:
+            if chunk:
+                emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        emit({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+class AsyncTrivia:
+    """
+    ASGI app running the Flask app on the event loop. Every request gets
+    an AsyncSession and the views use its sync side as db.session
+    (AsyncSession.run_sync): each query awaits the async driver instead
+    of holding a thread, so a worker serves many concurrent players.
+    The routes and the caches are the Flask ones, nothing is duplicated.
+    The streaming routes (THREADED_PATHS) run in a thread pool on the
+    regular sync engine. Views run on the loop, blocking calls other than
+    the database (a redis quiz session store) belong in threaded_paths.
+    """
+
+    def __init__(self, app, engine, replica=None, threads=ASGI_THREADS, threaded_paths=THREADED_PATHS):
+        self.app = app
+        self.engine = engine
+        self.replica = replica
+        self.threaded_paths = set(threaded_paths)
+        self.sessions = async_sessionmaker(engine, sync_session_class=AsyncRoutingSession, replica=replica)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi-wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        environ = wsgi_environ(scope, await read_body(receive))
+        if scope['path'] in self.threaded_paths:
+            loop = asyncio.get_running_loop()
+            # the thread waits for every message to be sent: backpressure for big exports
+            emit = lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result()
+            await loop.run_in_executor(self.executor, call_wsgi, self.app, environ, emit)
+            return
+        messages = []
+        async with self.sessions() as session:
+            await session.run_sync(self.run_request, environ, messages.append)
+        for message in messages:
+            await send(message)
+
+    def run_request(self, session, environ, emit):
+        # runs in a greenlet: the sync session awaits the async connection
+        with self.app.app_context():
+            # the request reuses this app context, and so this session
+            db.session.registry.set(session)
+            call_wsgi(self.app, environ, emit)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        await self.engine.dispose()
+        if self.replica is not None:
+            await self.replica.dispose()
+
+
+def create_asgi_app(test_config=None):
+    """create_app, served over async engines for the primary (and the replica)."""
+    app = create_app(test_config)
+    engine = create_engine_for(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+    replica = None
+    bind = (app.config.get('SQLALCHEMY_BINDS') or {}).get(REPLICA)
+    if bind is not None:
+        replica = create_engine_for(app.config, bind['url'], REPLICA)
+    return AsyncTrivia(app, engine, replica, app.config.get('ASGI_THREADS', ASGI_THREADS))
@@ -0,0 +1,266 @@
+import csv
+import io
+import json
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, track_change
+from flaskr.cache import category_cache
+from flaskr.reads import question_query, question_rows
+
+IMPORT_BATCH_SIZE = 1000
+# the report keeps the first errors only, a broken file shouldn't make a huge response
+MAX_IMPORT_ERRORS = 100
+IMPORT_FORMATS = ('ndjson', 'csv')
+BATCH_OPERATIONS = ('delete', 'update')
+MAX_BATCH_OPERATIONS = 1000
+EDITABLE_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+def read_ndjson(lines):
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'invalid json'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'expected a json object'
+            continue
+        yield line_number, row, None
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # line_num is the physical line, so quoted newlines are counted too
+        yield reader.line_num, row, None
+
+
+def validate_question(row, categories):
+    question = row.get('question')
+    answer = row.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        return None, 'question is required'
+    if not isinstance(answer, str) or not answer.strip():
+        return None, 'answer is required'
+    try:
+        category = int(row.get('category'))
+    except (TypeError, ValueError):
+        return None, 'category must be a category id'
+    if category not in categories:
+        return None, 'category {} does not exist'.format(category)
+    difficulty = row.get('difficulty')
+    if difficulty not in (None, ''):
+        try:
+            difficulty = int(difficulty)
+        except (TypeError, ValueError):
+            return None, 'difficulty must be a number'
+        if not 1 <= difficulty <= 5:
+            return None, 'difficulty must be between 1 and 5'
+    else:
+        difficulty = None
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty,
+    }, None
+
+
+class QuestionImport:
+    """
+    Imports questions from an NDJSON or CSV text stream in one transaction.
+    Rows are validated against the category ids and inserted in batches
+    with a multi-row INSERT ... RETURNING. Invalid rows are reported and
+    skipped, they never abort the load. Only one batch of rows is in
+    memory at a time, the commit listeners get a summary per batch.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def run(self, lines, format='ndjson'):
+        rows = read_csv(lines) if format == 'csv' else read_ndjson(lines)
+        categories = category_cache.get()
+        batch = []
+        for line_number, row, error in rows:
+            values = None
+            if error is None:
+                values, error = validate_question(row, categories)
+            if error is not None:
+                self.error(line_number, error)
+                continue
+            batch.append((line_number, values))
+            if len(batch) >= self.batch_size:
+                self.insert(batch)
+                batch = []
+        if batch:
+            self.insert(batch)
+        db.session.commit()
+        return self.report()
+
+    def insert(self, batch):
+        try:
+            self.insert_rows(batch)
+        except SQLAlchemyError:
+            # find the rows the database refused, one savepoint each
+            for line_number, values in batch:
+                try:
+                    self.insert_rows([(line_number, values)])
+                except SQLAlchemyError as error:
+                    self.error(line_number, str(getattr(error, 'orig', None) or error).splitlines()[0])
+
+    def insert_rows(self, batch):
+        values = [values for line_number, values in batch]
+        with db.session.begin_nested():
+            ids = db.session.execute(
+                insert(Question).returning(Question.id, sort_by_parameter_order=True),
+                values).scalars().all()
+            # not the rows: a big import would stay in memory until the commit
+            counts = {}
+            for row in values:
+                key = (row['category'], row['difficulty'])
+                counts[key] = counts.get(key, 0) + 1
+            track_change(db.session, 'questions', 'import', {'counts': counts})
+        self.inserted += len(ids)
+
+    def report(self):
+        return {
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+
+def import_questions(stream, format='ndjson', batch_size=IMPORT_BATCH_SIZE):
+    # stream is a binary file object, e.g. request.stream or an opened file,
+    # a body that isn't utf-8 raises UnicodeDecodeError and nothing is imported
+    lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        return QuestionImport(batch_size).run(lines, format)
+    except (SQLAlchemyError, UnicodeDecodeError):
+        db.session.rollback()
+        raise
+
+
+class QuestionBatch:
+    """
+    Applies a list of delete and update operations in one transaction.
+    The rows are read and locked with one IN query, deletes run as a
+    single DELETE ... WHERE id IN and updates as one executemany UPDATE
+    by primary key per set of changed fields, so the cost doesn't grow
+    with round trips. Every operation gets its own result, an invalid
+    one never aborts the others.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def check(self, operation, seen):
+        if not isinstance(operation, dict):
+            return 'expected a json object'
+        if operation.get('op') not in BATCH_OPERATIONS:
+            return 'op must be delete or update'
+        question_id = operation.get('id')
+        if not isinstance(question_id, int) or isinstance(question_id, bool):
+            return 'id must be a question id'
+        if question_id in seen:
+            return 'question {} appears more than once'.format(question_id)
+        if operation['op'] == 'update':
+            changes = set(operation) - {'op', 'id'}
+            if not changes:
+                return 'nothing to update'
+            unknown = changes - set(EDITABLE_FIELDS)
+            if unknown:
+                return 'unknown field {}'.format(sorted(unknown)[0])
+        # an invalid operation doesn't claim the id, a later valid one can use it
+        seen.add(question_id)
+        return None
+
+    def run(self, operations):
+        checked = []
+        seen = set()
+        for operation in operations:
+            error = self.check(operation, seen)
+            result = {'id': operation.get('id') if isinstance(operation, dict) else None}
+            self.results.append(result)
+            if error is not None:
+                result.update(status='invalid', error=error)
+            else:
+                checked.append((operation, result))
+
+        ids = [operation['id'] for operation, result in checked]
+        existing = {}
+        if ids:
+            # the counters get the previous category and difficulty from
+            # this read, a concurrent batch must not change them in between
+            query = question_query().where(Question.id.in_(ids)).with_for_update()
+            existing = {row['id']: row for row in question_rows(query)}
+        categories = category_cache.get()
+        deleted = []
+        updated = []
+        for operation, result in checked:
+            row = existing.get(operation['id'])
+            if row is None:
+                result['status'] = 'not_found'
+            elif operation['op'] == 'delete':
+                deleted.append(row)
+                result['status'] = 'deleted'
+            else:
+                changes = {field: operation[field] for field in EDITABLE_FIELDS if field in operation}
+                # the updated row has to be as valid as an imported one
+                values, error = validate_question(dict(row, **changes), categories)
+                if error is not None:
+                    result.update(status='invalid', error=error)
+                else:
+                    updated.append((row, changes, dict(values, id=row['id'])))
+                    result['status'] = 'updated'
+
+        if deleted:
+            db.session.execute(
+                delete(Question).where(Question.id.in_([row['id'] for row in deleted])),
+                execution_options={'synchronize_session': False})
+            for row in deleted:
+                track_change(db.session, 'questions', 'delete', row)
+        if updated:
+            # only write the fields each operation changed, grouped so
+            # every executemany has the same columns
+            groups = {}
+            for row, changes, values in updated:
+                columns = dict({field: values[field] for field in changes}, id=values['id'])
+                groups.setdefault(tuple(sorted(columns)), []).append(columns)
+            for rows in groups.values():
+                db.session.execute(update(Question), rows)
+            for row, changes, values in updated:
+                track_change(db.session, 'questions', 'update', dict(
+                    values, previous_category=row['category'], previous_difficulty=row['difficulty']))
+        db.session.commit()
+        return self.report(len(deleted), len(updated))
+
+    def report(self, deleted, updated):
+        return {
+            'deleted': deleted,
+            'updated': updated,
+            'failed': len(self.results) - deleted - updated,
+            'results': self.results,
+        }
+
+
+def apply_batch(operations):
+    try:
+        return QuestionBatch().run(operations)
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
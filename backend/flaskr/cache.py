@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+
+from models import Category, on_commit
+
+CATEGORY_CACHE_TTL = 300
+SEARCH_CACHE_TTL = 60
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_MEMORY = 8 * 1024 * 1024
+# rough per entry and per row cost on top of the text, for the memory bound
+ENTRY_OVERHEAD = 256
+ROW_OVERHEAD = 128
+
+
+class CategoryCache:
+    """
+    Process-local cache of the {id: type} category map.
+    Categories almost never change, so the map is built once and dropped
+    whenever a category is written. The TTL is only a safety net for
+    writes made by other processes.
+    """
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._categories = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CATEGORY_CACHE_TTL', self.ttl)
+        self.invalidate()
+
+    def get(self):
+        categories = self._categories
+        if categories is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return categories
+
+        with self._lock:
+            self.misses += 1
+            generation = self._generation
+        categories = {}
+        for category in Category.query.order_by(Category.id).execution_options(primary=True).all():
+            categories[category.id] = category.type
+        with self._lock:
+            # don't keep a map that was invalidated while we were loading it
+            if generation == self._generation:
+                self._categories = categories
+                self._loaded_at = time.monotonic()
+        return categories
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._categories = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'cached': self._categories is not None,
+        }
+
+
+category_cache = CategoryCache()
+
+
+def normalize_term(term):
+    # searches are case insensitive and don't care about repeated spaces
+    return ' '.join(term.casefold().split())
+
+
+class SearchCache:
+    """
+    LRU cache of search result pages keyed on the normalized term, the
+    page and the searched columns. Entries expire after ttl seconds and
+    the least recently used ones are dropped once there are more than
+    max_entries or their estimated size goes over max_bytes. Any commit
+    writing questions clears it.
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_SIZE, max_bytes=SEARCH_CACHE_MEMORY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SEARCH_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('SEARCH_CACHE_SIZE', self.max_entries)
+        self.max_bytes = app.config.get('SEARCH_CACHE_MEMORY', self.max_bytes)
+        self.invalidate()
+
+    def _size(self, rows):
+        size = ENTRY_OVERHEAD
+        for row in rows:
+            size += ROW_OVERHEAD + sum(len(value) for value in row.values() if isinstance(value, str))
+        return size
+
+    def _drop(self, key):
+        result, size, expires_at = self._entries.pop(key)
+        self.nbytes -= size
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get(self, term, limit, offset, answers, search):
+        """
+        Returns the cached (rows, total) of the page, or runs
+        search(term, limit, offset, answers) and keeps its result.
+        """
+        key = (normalize_term(term), limit, offset, answers)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            generation = self._generation
+
+        result = search(term, limit, offset, answers)
+        size = self._size(result[0])
+        with self._lock:
+            # don't keep a page that was invalidated while we were searching
+            if generation == self._generation and key not in self._entries:
+                self._entries[key] = (result, size, time.monotonic() + self.ttl)
+                self.nbytes += size
+                self._evict()
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+        }
+
+
+search_cache = SearchCache()
+
+
+@on_commit
+def invalidate_categories(changes):
+    if any(table == 'categories' for table, action, row in changes):
+        category_cache.invalidate()
+
+
+@on_commit
+def invalidate_searches(changes):
+    if any(table == 'questions' for table, action, row in changes):
+        search_cache.invalidate()
@@ -0,0 +1,162 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from flaskr.http_cache import data_version
+from models import on_commit
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are gzipped without it
+    brotli = None
+
+# smaller bodies fit in a packet or two, compressing them doesn't pay
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_MEMORY = 16 * 1024 * 1024
+# rough per entry cost on top of the body, for the memory bound
+ENTRY_OVERHEAD = 256
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class ResponseCache:
+    """
+    LRU cache of the encoded bodies of read endpoints, keyed on the
+    request (route and parameters), the data version being served and
+    the content encoding. A hit is sent as is: no query, no
+    serialization, no compression. The encoding is negotiated from
+    Accept-Encoding (br when brotli is installed, then gzip), bodies
+    under min_size are sent uncompressed. Any commit writing questions
+    or categories clears it, entries expire after ttl seconds to pick up
+    writes made by other processes.
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE,
+                 max_bytes=RESPONSE_CACHE_MEMORY, min_size=COMPRESSION_MIN_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('RESPONSE_CACHE_SIZE', self.max_entries)
+        self.max_bytes = app.config.get('RESPONSE_CACHE_MEMORY', self.max_bytes)
+        self.min_size = app.config.get('COMPRESSION_MIN_SIZE', self.min_size)
+        self.invalidate()
+
+    def negotiate(self):
+        """The encoding to send the response with, None for identity."""
+        return request.accept_encodings.best_match(self.encodings)
+
+    def _drop(self, key):
+        body, encoding, mimetype, expires_at = self._entries.pop(key)
+        self.nbytes -= ENTRY_OVERHEAD + len(body)
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def respond(self, key, build):
+        """
+        Returns the cached response of key, or the response of build()
+        encoded for the client. Only 200 responses are kept.
+        """
+        encoding = self.negotiate()
+        key = (key, data_version.served()[0], encoding)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self.response(*entry[:3])
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            generation = self._generation
+
+        response = make_response(build())
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        body = response.get_data()
+        if encoding is not None and len(body) >= self.min_size:
+            body = compress(body, encoding)
+        else:
+            encoding = None
+        with self._lock:
+            # don't keep a body that was invalidated while we were building it
+            if generation == self._generation and key not in self._entries:
+                self._entries[key] = (body, encoding, response.mimetype, time.monotonic() + self.ttl)
+                self.nbytes += ENTRY_OVERHEAD + len(body)
+                self._evict()
+        return self.response(body, encoding, response.mimetype)
+
+    def response(self, body, encoding, mimetype):
+        response = Response(body, mimetype=mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def request_key():
+    # the order of the query parameters doesn't change the response
+    return request.path, tuple(sorted(request.args.items(multi=True)))
+
+
+def compressed(view):
+    """Serves a GET endpoint through the response cache, keyed on its path and parameters."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return response_cache.respond(request_key(), lambda: view(*args, **kwargs))
+    return wrapper
+
+
+@on_commit
+def invalidate_responses(changes):
+    response_cache.invalidate()
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from models import db, Question, on_commit
+
+QUESTION_COUNTS_TTL = 300
+
+
+class QuestionCounts:
+    """
+    Number of questions per (category, difficulty), so totals never need
+    a count query. Loaded with one GROUP BY over the (category,
+    difficulty, id) index, then kept up to date by the commit listener.
+    Reloaded after ttl seconds to reconcile with writes of other
+    processes.
+    """
+
+    def __init__(self, ttl=QUESTION_COUNTS_TTL):
+        self.ttl = ttl
+        self._counts = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('QUESTION_COUNTS_TTL', self.ttl)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._counts = None
+
+    def _ensure_loaded(self):
+        counts = self._counts
+        if counts is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return counts
+        with self._lock:
+            generation = self._generation
+        # kept up to date by the commits from here on, load from the primary
+        rows = db.session.execute(
+            select(Question.category, Question.difficulty, func.count(Question.id))
+            .group_by(Question.category, Question.difficulty).execution_options(primary=True))
+        counts = {(category, difficulty): count for category, difficulty, count in rows}
+        with self._lock:
+            if generation == self._generation:
+                self._counts = counts
+                self._loaded_at = time.monotonic()
+        return counts
+
+    def _add(self, category, difficulty, delta):
+        key = (category, difficulty)
+        count = self._counts.get(key, 0) + delta
+        if count > 0:
+            self._counts[key] = count
+        else:
+            self._counts.pop(key, None)
+
+    def apply(self, changes):
+        with self._lock:
+            # a load running now may have missed these, it must not be kept
+            self._generation += 1
+            if self._counts is None:
+                return
+            for action, row in changes:
+                if action == 'import':
+                    for (category, difficulty), count in row['counts'].items():
+                        self._add(category, difficulty, count)
+                elif action == 'insert':
+                    self._add(row['category'], row['difficulty'], 1)
+                elif action == 'delete':
+                    self._add(row['category'], row['difficulty'], -1)
+                else:
+                    self._add(row['previous_category'], row['previous_difficulty'], -1)
+                    self._add(row['category'], row['difficulty'], 1)
+
+    def total(self, category=None, difficulty=None):
+        """Questions of the category and difficulty, None matches any."""
+        counts = self._ensure_loaded()
+        return sum(count for (key_category, key_difficulty), count in list(counts.items())
+                   if (category is None or key_category == category)
+                   and (difficulty is None or key_difficulty == difficulty))
+
+    def by_category(self):
+        totals = {}
+        for (category, difficulty), count in list(self._ensure_loaded().items()):
+            totals[category] = totals.get(category, 0) + count
+        return totals
+
+
+question_counts = QuestionCounts()
+
+
+@on_commit
+def update_question_counts(changes):
+    changes = [(action, row) for table, action, row in changes if table == 'questions']
+    if changes:
+        question_counts.apply(changes)
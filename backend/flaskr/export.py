@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import select
+
+from models import db, Question
+
+EXPORT_COLUMNS = (Question.id, Question.question, Question.answer,
+                  Question.difficulty, Question.category)
+EXPORT_KEYS = tuple(column.key for column in EXPORT_COLUMNS)
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# rows fetched per round trip from the server side cursor
+EXPORT_BATCH_SIZE = 1000
+# size of the chunks written to the client
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def export_rows(category=None, difficulty=None):
+    query = select(*EXPORT_COLUMNS).order_by(Question.id)
+    if category is not None:
+        query = query.where(Question.category == category)
+    if difficulty is not None:
+        query = query.where(Question.difficulty == difficulty)
+    # yield_per streams the result (server side cursor on postgres),
+    # only one batch of rows is in memory at a time. Reading the whole
+    # table is the point of an export, the query plan checks skip it
+    return db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE, full_scan=True))
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        # rows are tuples in EXPORT_COLUMNS order, from the database or a snapshot
+        yield json.dumps(dict(zip(EXPORT_KEYS, row))) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_KEYS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def chunked(lines, size=EXPORT_CHUNK_SIZE):
+    # join small lines so the server doesn't write one row per syscall
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_questions(format='ndjson', category=None, difficulty=None, gzip=False, rows=None):
+    """Yields the encoded export, never holding more than a batch of rows."""
+    if rows is None:
+        rows = export_rows(category, difficulty)
+    lines = csv_lines(rows) if format == 'csv' else ndjson_lines(rows)
+    chunks = chunked(lines)
+    return gzipped(chunks) if gzip else chunks
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from models import on_commit
+
+HTTP_CACHE_MAX_AGE = 0
+# seconds a worker vouches for its version, commits of other workers don't bump it
+HTTP_CACHE_TTL = 60
+
+
+class DataVersion:
+    """
+    Counter bumped by every commit that writes questions or categories.
+    The epoch is random per process: versions of two workers are never
+    compared, a client switching workers just gets a full response. The
+    counter only sees the commits of this process, so validators also
+    change with every refresh window (see conditional).
+    """
+
+    def __init__(self):
+        self.epoch = os.urandom(4).hex()
+        self.value = 0
+        self.last_modified = time.time()
+        self.pinned = None
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+            self.last_modified = time.time()
+
+    def pin(self, version, last_modified):
+        # the reads are served from a snapshot of this version (flaskr.snapshot)
+        self.pinned = (version, last_modified)
+
+    def unpin(self):
+        self.pinned = None
+
+    def served(self):
+        """(version, last modified time) of the data the reads see."""
+        return self.pinned or (self.value, self.last_modified)
+
+    def etag(self, path, args, window=0):
+        # the order of the query parameters doesn't change the response
+        key = '{}:{}:{}:{}:{}'.format(self.epoch, self.served()[0], window, path, sorted(args.items(multi=True)))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+data_version = DataVersion()
+
+
+def refresh_window(ttl):
+    """Start of the current ttl second window, 0 when ttl is 0."""
+    if not ttl:
+        return 0
+    now = time.time()
+    return int(now - now % ttl)
+
+
+@on_commit
+def bump_data_version(changes):
+    data_version.bump()
+
+
+def conditional(view=None, exists=None):
+    """
+    ETag / Last-Modified support for read endpoints. When the client
+    already has the current version a 304 is returned before the view
+    runs, so no query is made. exists(**view_args), when given, is a
+    cheap check that the resource is there: a 304 is only sent for it,
+    otherwise the view runs and answers its 404. Another worker may have written since,
+    so the validators expire every HTTP_CACHE_TTL seconds: the ETag
+    includes the refresh window and Last-Modified is at least its start.
+    HTTP_CACHE_TTL = 0 keeps them until the next write, for a single
+    process deployment.
+    """
+    if view is None:
+        return lambda view: conditional(view, exists)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        window = refresh_window(current_app.config.get('HTTP_CACHE_TTL', HTTP_CACHE_TTL))
+        etag = data_version.etag(request.path, request.args, window)
+        last_modified = max(int(data_version.served()[1]), window)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and since.timestamp() >= last_modified
+        if not_modified and exists is not None:
+            not_modified = exists(*args, **kwargs)
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        # weak etag, the body may be sent compressed or not
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+        response.cache_control.must_revalidate = True
+        return response
+    return wrapper
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import on_checkout
+
+SLOW_REQUEST_MS = 500
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+# a checkout that finds an idle connection takes microseconds
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def labels(**values):
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in sorted(values.items())) + '}'
+
+
+class Metrics:
+    """
+    Per endpoint request metrics: latency histograms, status codes and
+    the SQL statements each request issued, counted through SQLAlchemy
+    engine events, and how long connection pool checkouts waited per
+    bind. Rendered in the Prometheus text format by
+    /api/metrics. Every response gets a Server-Timing header and
+    requests slower than SLOW_REQUEST_MS are logged.
+    """
+
+    def __init__(self):
+        self.collectors = {}
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+        self.sql_seconds = defaultdict(float)
+        self.responses = defaultdict(int)
+        self.checkouts = defaultdict(lambda: Histogram(CHECKOUT_BUCKETS))
+
+    def init_app(self, app):
+        self.reset()
+        self.slow_request_ms = app.config.get('SLOW_REQUEST_MS', SLOW_REQUEST_MS)
+        self.logger = app.logger
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def collect(self, name, type, help, value):
+        """Adds a metric whose value is read from value() at every scrape."""
+        self.collectors[name] = (type, help, value)
+
+    def observe_checkout(self, bind, seconds):
+        with self._lock:
+            self.checkouts[bind].observe(seconds)
+
+    def before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    def after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        statements = g.sql_statements
+        sql_seconds = g.sql_seconds
+        with self._lock:
+            self.latency[endpoint].observe(elapsed)
+            self.statements[endpoint].observe(statements)
+            self.sql_seconds[endpoint] += sql_seconds
+            self.responses[(endpoint, request.method, response.status_code)] += 1
+
+        response.headers.add('Server-Timing', 'app;dur={:.2f}, db;dur={:.2f};desc="{} queries"'.format(
+            elapsed * 1000, sql_seconds * 1000, statements))
+        if elapsed * 1000 >= self.slow_request_ms:
+            self.logger.warning('slow request %s %s: %.1fms, %d queries, %.1fms in the database',
+                                request.method, request.full_path, elapsed * 1000,
+                                statements, sql_seconds * 1000)
+        return response
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP trivia_request_duration_seconds Request latency by endpoint.',
+                '# TYPE trivia_request_duration_seconds histogram',
+            ]
+            lines += self.render_histograms('trivia_request_duration_seconds', self.latency)
+            lines += [
+                '# HELP trivia_request_sql_statements SQL statements issued per request by endpoint.',
+                '# TYPE trivia_request_sql_statements histogram',
+            ]
+            lines += self.render_histograms('trivia_request_sql_statements', self.statements)
+            lines += [
+                '# HELP trivia_sql_duration_seconds_total Time spent running SQL by endpoint.',
+                '# TYPE trivia_sql_duration_seconds_total counter',
+            ]
+            for endpoint, seconds in sorted(self.sql_seconds.items()):
+                lines.append('trivia_sql_duration_seconds_total{} {}'.format(
+                    labels(endpoint=endpoint), seconds))
+            lines += [
+                '# HELP trivia_responses_total Responses by endpoint, method and status code.',
+                '# TYPE trivia_responses_total counter',
+            ]
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append('trivia_responses_total{} {}'.format(
+                    labels(endpoint=endpoint, method=method, status=status), count))
+            lines += [
+                '# HELP trivia_db_pool_checkout_seconds Time spent waiting for a pooled connection by bind.',
+                '# TYPE trivia_db_pool_checkout_seconds histogram',
+            ]
+            lines += self.render_histograms('trivia_db_pool_checkout_seconds', self.checkouts, 'bind')
+        for name, (type, help, value) in sorted(self.collectors.items()):
+            lines += [
+                '# HELP {} {}'.format(name, help),
+                '# TYPE {} {}'.format(name, type),
+                '{} {}'.format(name, value()),
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def render_histograms(self, name, histograms, label='endpoint'):
+        lines = []
+        for key, histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append('{}_bucket{} {}'.format(name, labels(**{label: key, 'le': bound}), count))
+            lines.append('{}_bucket{} {}'.format(name, labels(**{label: key, 'le': '+Inf'}), histogram.count))
+            lines.append('{}_sum{} {}'.format(name, labels(**{label: key}), histogram.sum))
+            lines.append('{}_count{} {}'.format(name, labels(**{label: key}), histogram.count))
+        return lines
+
+
+metrics = Metrics()
+on_checkout(metrics.observe_checkout)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(connection, cursor, statement, parameters, context, executemany):
+    context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(connection, cursor, statement, parameters, context, executemany):
+    # statements run outside of a request (startup, cli) are not counted
+    if has_app_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += time.perf_counter() - context.metrics_started
@@ -0,0 +1,171 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = 'X-Profile-Token'
+# reports kept on disk, the oldest are deleted first
+PROFILE_KEEP = 50
+# functions listed in a report, by cumulative time
+PROFILE_LINES = 60
+# longest parameter list written for a statement
+SQL_PARAMETERS_LENGTH = 200
+REPORT_ID = re.compile(r'^[\w.-]+$')
+
+
+def parse_rates(value):
+    """{endpoint: rate} from a dict or an 'endpoint=rate,...' string."""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return {endpoint: float(rate) for endpoint, rate in value.items()}
+    rates = {}
+    for item in value.split(','):
+        endpoint, _, rate = item.partition('=')
+        rates[endpoint.strip()] = float(rate or 1)
+    return rates
+
+
+class Profiler:
+    """
+    On-demand request profiler. A request is profiled when it carries the
+    PROFILER_TOKEN in the X-Profile-Token header, or at random at the
+    rate set for its endpoint in PROFILE_ENDPOINTS. The profile
+    (cProfile, by cumulative time) and the SQL the request issued are
+    written to a text report in PROFILE_DIR, which keeps the last
+    PROFILE_KEEP reports. With neither setting nothing is installed:
+    no hooks, no engine listeners, no cost.
+    """
+
+    def __init__(self):
+        self.token = None
+        self.rates = {}
+        self.directory = None
+        self.keep = PROFILE_KEEP
+        self.enabled = False
+
+    def init_app(self, app):
+        self.token = app.config.get('PROFILER_TOKEN', os.environ.get('PROFILER_TOKEN'))
+        self.rates = parse_rates(app.config.get('PROFILE_ENDPOINTS', os.environ.get('PROFILE_ENDPOINTS')))
+        self.directory = app.config.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        self.keep = app.config.get('PROFILE_KEEP', self.keep)
+        self.enabled = bool(self.token or self.rates)
+        if not self.enabled:
+            return
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        if not event.contains(Engine, 'before_cursor_execute', start_statement):
+            event.listen(Engine, 'before_cursor_execute', start_statement)
+            event.listen(Engine, 'after_cursor_execute', end_statement)
+
+    def authorized(self):
+        token = request.headers.get(PROFILE_HEADER)
+        return bool(self.token and token) and hmac.compare_digest(token, self.token)
+
+    def wanted(self):
+        if PROFILE_HEADER in request.headers and self.authorized():
+            return True
+        rate = self.rates.get(request.endpoint)
+        return rate is not None and random.random() < rate
+
+    def before_request(self):
+        if not self.wanted():
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running on this thread
+            return
+        g.profile = profile
+        g.profile_started = time.perf_counter()
+        g.profile_sql = []
+
+    def after_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        profile.disable()
+        elapsed = time.perf_counter() - g.profile_started
+        statements = g.pop('profile_sql')
+        response.headers['X-Profile-Id'] = self.write(profile, elapsed, statements, response.status_code)
+        return response
+
+    def teardown_request(self, error):
+        # after_request doesn't run when the request failed with an exception
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            g.pop('profile_sql', None)
+
+    def write(self, profile, elapsed, statements, status):
+        now = datetime.now(timezone.utc)
+        report_id = '{:%Y%m%dT%H%M%S.%f}-{}-{}'.format(now, os.getpid(), request.endpoint or 'unmatched')
+        out = io.StringIO()
+        out.write('{} {} -> {}\n'.format(request.method, request.full_path, status))
+        out.write('endpoint: {}\nat: {}\nduration: {:.2f}ms\n'.format(request.endpoint, now.isoformat(), elapsed * 1000))
+        out.write('\nSQL ({} statements, {:.2f}ms)\n'.format(
+            len(statements), sum(seconds for _, _, seconds in statements) * 1000))
+        for statement, parameters, seconds in statements:
+            out.write('\n{:.2f}ms  {}\n'.format(seconds * 1000, statement))
+            if parameters:
+                out.write('  parameters: {}\n'.format(repr(parameters)[:SQL_PARAMETERS_LENGTH]))
+        out.write('\nPROFILE\n')
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, report_id + '.txt')
+        with open(path + '.tmp', 'w') as report:
+            report.write(out.getvalue())
+        # readers never see a partial report
+        os.replace(path + '.tmp', path)
+        self.prune()
+        return report_id
+
+    def prune(self):
+        for report_id in self.reports()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, report_id + '.txt'))
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+
+    def reports(self):
+        """The ids of the reports on disk, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((name[:-len('.txt')] for name in names if name.endswith('.txt')), reverse=True)
+
+    def path(self, report_id):
+        """The file of the report, None for an unknown id."""
+        if not REPORT_ID.match(report_id):
+            return None
+        path = os.path.join(self.directory, report_id + '.txt')
+        return path if os.path.exists(path) else None
+
+
+profiler = Profiler()
+
+
+def start_statement(connection, cursor, statement, parameters, context, executemany):
+    if has_app_context() and 'profile_sql' in g:
+        context.profile_started = time.perf_counter()
+
+
+def end_statement(connection, cursor, statement, parameters, context, executemany):
+    # only installed when the profiler is on, profile_sql marks a profiled request
+    started = getattr(context, 'profile_started', None)
+    if started is not None and has_app_context() and 'profile_sql' in g:
+        g.profile_sql.append((statement, parameters, time.perf_counter() - started))
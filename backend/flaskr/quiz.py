@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+
+from sqlalchemy import select
+
+from models import db, Question, on_commit
+
+ALL_CATEGORIES = 0
+QUIZ_INDEX_TTL = 600
+# random picks tried before falling back to scanning the unseen ids
+SAMPLE_ATTEMPTS = 16
+
+
+class QuestionIndex:
+    """
+    In-memory index of question ids per category, used to sample quiz
+    questions without loading the candidate set from the database.
+    Each category keeps an id list plus an {id: position} map, so adding,
+    removing (swap with the last id) and sampling are all O(1).
+    Category 0 holds every question.
+    """
+
+    def __init__(self, ttl=QUIZ_INDEX_TTL):
+        self.ttl = ttl
+        self._ids = None
+        self._positions = None
+        self._categories = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('QUIZ_INDEX_TTL', self.ttl)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._ids = None
+
+    def expire(self):
+        """Reloads the index at the next use, the current one is used until then."""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = 0
+
+    def _ensure_loaded(self):
+        # the TTL rebuild picks up questions written by other processes
+        if self._ids is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            generation = self._generation
+        # from the primary: a lagging replica would miss ids the commits won't add again
+        rows = db.session.execute(select(Question.id, Question.category).execution_options(primary=True)).all()
+        # built off the lock, sampling goes on with the current index meanwhile
+        ids = {ALL_CATEGORIES: []}
+        positions = {ALL_CATEGORIES: {}}
+        categories = {}
+        for question_id, category in rows:
+            categories[question_id] = category
+            for key in (ALL_CATEGORIES, category):
+                keyed = ids.setdefault(key, [])
+                positions.setdefault(key, {})[question_id] = len(keyed)
+                keyed.append(question_id)
+        with self._lock:
+            if generation != self._generation and self._ids is not None:
+                # the current index has commits this load may have missed, keep it
+                return
+            self._ids, self._positions, self._categories = ids, positions, categories
+            # a first load that raced with commits is reloaded at the next use
+            self._loaded_at = time.monotonic() if generation == self._generation else 0
+
+    def _add(self, question_id, category):
+        if question_id in self._categories:
+            self._remove(question_id)
+        self._categories[question_id] = category
+        for key in (ALL_CATEGORIES, category):
+            ids = self._ids.setdefault(key, [])
+            self._positions.setdefault(key, {})[question_id] = len(ids)
+            ids.append(question_id)
+
+    def _remove(self, question_id):
+        category = self._categories.pop(question_id, None)
+        if category is None:
+            return
+        for key in (ALL_CATEGORIES, category):
+            ids = self._ids[key]
+            positions = self._positions[key]
+            position = positions.pop(question_id)
+            last = ids.pop()
+            if last != question_id:
+                ids[position] = last
+                positions[last] = position
+
+    def add(self, question_id, category):
+        with self._lock:
+            # a load running now may have missed it
+            self._generation += 1
+            if self._ids is not None:
+                self._add(question_id, category)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._generation += 1
+            if self._ids is not None:
+                self._remove(question_id)
+
+    def size(self, category=ALL_CATEGORIES):
+        self._ensure_loaded()
+        return len(self._ids.get(category, ()))
+
+    def sample(self, category, seen):
+        """
+        Returns a random id of the category that is not in seen, or None
+        when every question of the category has been seen.
+        """
+        picked = self.sample_many(category, seen, 1)
+        return picked[0] if picked else None
+
+    def sample_many(self, category, seen, count, picked=()):
+        """
+        Returns up to count distinct random ids of the category that are
+        not in seen nor in picked, fewer when the category runs out.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            ids = self._ids.get(category)
+            if not ids:
+                return []
+            sampled = []
+            # seen may be a session's sorted id array, it is only ever probed
+            chosen = set(picked)
+            for _ in range(SAMPLE_ATTEMPTS * count):
+                if len(sampled) == count:
+                    return sampled
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in seen and question_id not in chosen:
+                    chosen.add(question_id)
+                    sampled.append(question_id)
+            # most of the category was seen, pick from what is left
+            unseen = [question_id for question_id in ids
+                      if question_id not in seen and question_id not in chosen]
+            return sampled + random.sample(unseen, min(count - len(sampled), len(unseen)))
+
+question_index = QuestionIndex()
+
+
+@on_commit
+def update_question_index(changes):
+    for table, action, row in changes:
+        if table != 'questions':
+            continue
+        if action == 'import':
+            # reloaded with one query at the next use, not replayed row by row
+            question_index.expire()
+        elif action == 'delete':
+            question_index.remove(row['id'])
+        else:
+            question_index.add(row['id'], row['category'])
@@ -0,0 +1,184 @@
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+QUIZ_SESSION_TTL = 1800
+QUIZ_SESSION_MEMORY = 16 * 1024 * 1024
+# rough size of a session besides its seen ids: token, dict entry, object
+SESSION_OVERHEAD = 256
+
+
+class SeenIds:
+    """Sorted array of 32 bit question ids, 4 bytes per seen question."""
+
+    def __init__(self, ids=()):
+        self._ids = array('I', sorted(set(ids)))
+
+    def __contains__(self, question_id):
+        position = bisect_left(self._ids, question_id)
+        return position < len(self._ids) and self._ids[position] == question_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, question_id):
+        position = bisect_left(self._ids, question_id)
+        if position == len(self._ids) or self._ids[position] != question_id:
+            self._ids.insert(position, question_id)
+
+    @property
+    def nbytes(self):
+        return self._ids.itemsize * len(self._ids)
+
+
+class SeenBitmap:
+    """Read-only view of a redis bitmap, bit n is set once question n was seen."""
+
+    def __init__(self, bitmap):
+        self._bitmap = bitmap or b''
+
+    def __contains__(self, question_id):
+        byte = question_id >> 3
+        if question_id < 0 or byte >= len(self._bitmap):
+            return False
+        # redis numbers bits from the most significant bit of each byte
+        return bool(self._bitmap[byte] & (0x80 >> (question_id & 7)))
+
+
+class QuizSession:
+    def __init__(self, category, seen=None):
+        self.category = category
+        self.seen = seen if seen is not None else SeenIds()
+
+
+class MemoryQuizSessionStore:
+    """
+    Keeps sessions in process, least recently used first. Sessions expire
+    after ttl seconds and the oldest ones are dropped once the estimated
+    size of all sessions goes over max_bytes.
+    """
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_bytes=QUIZ_SESSION_MEMORY):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _size(self, session):
+        return SESSION_OVERHEAD + session.seen.nbytes
+
+    def _drop(self, token):
+        session, expires_at = self._sessions.pop(token)
+        self.nbytes -= self._size(session)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            token, (session, expires_at) = next(iter(self._sessions.items()))
+            if expires_at > now and self.nbytes <= self.max_bytes:
+                break
+            self._drop(token)
+
+    def create(self, category):
+        token = secrets.token_urlsafe(16)
+        session = QuizSession(category)
+        with self._lock:
+            self._sessions[token] = (session, time.monotonic() + self.ttl)
+            self.nbytes += self._size(session)
+            self._evict()
+        return token
+
+    def get(self, token):
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            session, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._drop(token)
+                return None
+            return session
+
+    def add_seen(self, token, question_id):
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return
+            session, expires_at = entry
+            self.nbytes -= self._size(session)
+            session.seen.add(question_id)
+            self.nbytes += self._size(session)
+            # every answer keeps the session alive for another ttl
+            self._sessions[token] = (session, time.monotonic() + self.ttl)
+            self._sessions.move_to_end(token)
+            self._evict()
+
+
+class RedisQuizSessionStore:
+    """
+    Keeps sessions in redis so every worker sees them. The seen set is a
+    bitmap indexed by question id and both keys expire after ttl seconds.
+    """
+
+    def __init__(self, url, ttl=QUIZ_SESSION_TTL):
+        # redis is optional, only needed when QUIZ_SESSION_STORE is a redis url
+        import redis
+        self.ttl = ttl
+        self.redis = redis.Redis.from_url(url)
+
+    def create(self, category):
+        token = secrets.token_urlsafe(16)
+        self.redis.set('quiz:' + token, category, ex=self.ttl)
+        return token
+
+    def get(self, token):
+        category, bitmap = self.redis.mget('quiz:' + token, 'quiz:' + token + ':seen')
+        if category is None:
+            return None
+        return QuizSession(int(category), SeenBitmap(bitmap))
+
+    def add_seen(self, token, question_id):
+        pipeline = self.redis.pipeline()
+        pipeline.setbit('quiz:' + token + ':seen', question_id, 1)
+        pipeline.expire('quiz:' + token, self.ttl)
+        pipeline.expire('quiz:' + token + ':seen', self.ttl)
+        pipeline.execute()
+
+
+class QuizSessions:
+    """
+    Server side quiz sessions, the client only sends a token and the
+    server remembers which questions were already asked.
+    QUIZ_SESSION_STORE picks the store: 'memory' or a redis:// url.
+    """
+
+    def __init__(self):
+        self.store = MemoryQuizSessionStore()
+
+    def init_app(self, app):
+        url = app.config.get('QUIZ_SESSION_STORE', 'memory')
+        ttl = app.config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+        if url == 'memory':
+            self.store = MemoryQuizSessionStore(
+                ttl, app.config.get('QUIZ_SESSION_MEMORY', QUIZ_SESSION_MEMORY))
+        else:
+            self.store = RedisQuizSessionStore(url, ttl)
+
+    def create(self, category):
+        return self.store.create(category)
+
+    def get(self, token):
+        return self.store.get(token)
+
+    def add_seen(self, token, question_id):
+        self.store.add_seen(token, question_id)
+
+
+quiz_sessions = QuizSessions()
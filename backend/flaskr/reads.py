@@ -0,0 +1,100 @@
+import re
+
+from flask import Response, abort, current_app, jsonify
+from sqlalchemy import select
+
+from models import db, Question
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, jsonify is used without it
+    orjson = None
+
+# sorted, so the row dicts come out in the key order jsonify would write
+QUESTION_FIELDS = ('answer', 'category', 'difficulty', 'id', 'question')
+QUESTION_COLUMNS = {field: getattr(Question, field) for field in QUESTION_FIELDS}
+# ?sort= values, ties are broken by id so pages are stable
+QUESTION_SORTS = {
+    'id': (Question.id,),
+    '-id': (Question.id.desc(),),
+    'difficulty': (Question.difficulty, Question.id),
+    '-difficulty': (Question.difficulty.desc(), Question.id.desc()),
+}
+# what json.dumps(ensure_ascii=True) escapes that orjson writes as is
+NON_ASCII = re.compile(r'[^\x00-\x7e]')
+
+
+def question_fields(request):
+    """
+    Parses the optional ?fields=id,question projection.
+    Unknown fields are a bad request.
+    """
+    fields = request.args.get('fields')
+    if fields is None:
+        return QUESTION_FIELDS
+    fields = set(field.strip() for field in fields.split(',') if field.strip())
+    if not fields or not fields.issubset(QUESTION_FIELDS):
+        abort(400)
+    return tuple(sorted(fields))
+
+
+def question_query():
+    return select(Question.id).order_by(Question.id)
+
+
+def question_rows(query, fields=QUESTION_FIELDS):
+    """
+    Runs the query for the given columns only and returns plain dicts,
+    the same as Question.format() without building ORM objects.
+    """
+    columns = [QUESTION_COLUMNS[field] for field in fields]
+    rows = db.session.execute(query.with_only_columns(*columns))
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def project(questions, fields):
+    if fields == QUESTION_FIELDS:
+        return questions
+    return [{field: question[field] for field in fields} for question in questions]
+
+
+def json_response(payload, status=200):
+    """
+    jsonify with orjson when it is installed. The output must be the
+    bytes jsonify would send, so nested dicts have to be built in sorted
+    key order (like the question_rows dicts). Top level keys are sorted
+    here and int keyed maps such as the categories are converted.
+    Non ascii characters are escaped the way jsonify does. Falls back to
+    jsonify whenever the bytes could differ.
+    """
+    if orjson is None or current_app.debug:
+        return jsonify_response(payload, status)
+    prepared = {}
+    for key in sorted(payload):
+        value = payload[key]
+        if isinstance(value, dict):
+            value = {str(k): v for k, v in sorted(value.items())}
+        prepared[key] = value
+    try:
+        body = orjson.dumps(prepared)
+    except TypeError:
+        return jsonify_response(payload, status)
+    # jsonify escapes non ascii characters, orjson writes utf-8
+    if not body.isascii():
+        body = NON_ASCII.sub(escape, body.decode()).encode()
+    return Response(body + b'\n', status=status, mimetype='application/json')
+
+
+def escape(match):
+    code = ord(match.group())
+    if code > 0xffff:
+        # outside the BMP, written as a utf-16 surrogate pair
+        code -= 0x10000
+        return '\\u{:04x}\\u{:04x}'.format(0xd800 | code >> 10, 0xdc00 | code & 0x3ff)
+    return '\\u{:04x}'.format(code)
+
+
+def jsonify_response(payload, status):
+    response = jsonify(payload)
+    response.status_code = status
+    return response
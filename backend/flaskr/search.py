@@ -0,0 +1,208 @@
+from flask import current_app
+from sqlalchemy import select, func, or_, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question
+from flaskr.reads import QUESTION_FIELDS, QUESTION_COLUMNS
+
+# same column order as QUESTION_FIELDS
+SELECT_QUESTIONS = 'SELECT q.answer, q.category, q.difficulty, q.id, q.question '
+
+# FTS5 trigram needs at least three characters to match anything
+TRIGRAM_MIN_LENGTH = 3
+
+
+def like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+class LikeSearchBackend:
+    """
+    Substring search with ILIKE, unranked apart from id order.
+    Used when the database has no usable full-text index.
+    """
+    name = 'like'
+
+    def setup(self, connection):
+        pass
+
+    def available(self, connection):
+        return True
+
+    def search(self, term, limit, offset, answers=False):
+        pattern = like_pattern(term)
+        condition = Question.question.ilike(pattern, escape='\\')
+        if answers:
+            condition = or_(condition, Question.answer.ilike(pattern, escape='\\'))
+        rows = db.session.execute(
+            select(*QUESTION_COLUMNS.values()).where(condition)
+            .order_by(Question.id).limit(limit).offset(offset))
+        total = db.session.execute(
+            select(func.count(Question.id)).where(condition)).scalar()
+        return [dict(zip(QUESTION_FIELDS, row)) for row in rows], total
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    """
+    pg_trgm GIN indexes serve the ILIKE filter, results are ranked by
+    ts_rank over the question text plus trigram word similarity.
+    """
+    name = 'postgres'
+
+    def setup(self, connection):
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+            'ON questions USING gin (question gin_trgm_ops)'))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm '
+            'ON questions USING gin (answer gin_trgm_ops)'))
+
+    def available(self, connection):
+        count = connection.execute(text(
+            "SELECT count(*) FROM pg_indexes WHERE indexname IN "
+            "('ix_questions_question_trgm', 'ix_questions_answer_trgm')")).scalar()
+        return count == 2
+
+    def search(self, term, limit, offset, answers=False):
+        pattern = like_pattern(term)
+        where = "question ILIKE :pattern"
+        rank = ("ts_rank(to_tsvector('english', coalesce(question, '')), "
+                "plainto_tsquery('english', :term)) + word_similarity(:term, question)")
+        if answers:
+            where = "(question ILIKE :pattern OR answer ILIKE :pattern)"
+            rank = ("ts_rank(to_tsvector('english', coalesce(question, '') || ' ' || "
+                    "coalesce(answer, '')), plainto_tsquery('english', :term)) + "
+                    "greatest(word_similarity(:term, question), word_similarity(:term, answer))")
+        params = {'pattern': pattern, 'term': term, 'limit': limit, 'offset': offset}
+        rows = db.session.execute(text(
+            SELECT_QUESTIONS + 'FROM questions q '
+            'WHERE ' + where + ' ORDER BY ' + rank + ' DESC, id '
+            'LIMIT :limit OFFSET :offset').execution_options(ranked=True), params)
+        total = db.session.execute(text(
+            'SELECT count(*) FROM questions WHERE ' + where), params).scalar()
+        return [dict(zip(QUESTION_FIELDS, row)) for row in rows], total
+
+
+class SqliteSearchBackend(LikeSearchBackend):
+    """
+    SQLite FTS5 external content table with the trigram tokenizer, so it
+    keeps the substring semantics of ILIKE. Triggers keep it in sync with
+    the questions table and results are ranked with bm25.
+    """
+    name = 'sqlite'
+
+    def setup(self, connection):
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'")).first()
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5("
+            "question, answer, content='questions', content_rowid='id', "
+            "tokenize='trigram')"))
+        connection.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN "
+            "INSERT INTO questions_fts(rowid, question, answer) "
+            "VALUES (new.id, new.question, new.answer); END"))
+        connection.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+            "INSERT INTO questions_fts(questions_fts, rowid, question, answer) "
+            "VALUES ('delete', old.id, old.question, old.answer); END"))
+        connection.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE ON questions BEGIN "
+            "INSERT INTO questions_fts(questions_fts, rowid, question, answer) "
+            "VALUES ('delete', old.id, old.question, old.answer); "
+            "INSERT INTO questions_fts(rowid, question, answer) "
+            "VALUES (new.id, new.question, new.answer); END"))
+        if not exists:
+            connection.execute(text("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
+
+    def available(self, connection):
+        # the index is useless without the triggers keeping it in sync
+        count = connection.execute(text(
+            "SELECT count(*) FROM sqlite_master WHERE name IN ('questions_fts', "
+            "'questions_fts_insert', 'questions_fts_delete', 'questions_fts_update')")).scalar()
+        return count == 4
+
+    def search(self, term, limit, offset, answers=False):
+        if len(term) < TRIGRAM_MIN_LENGTH:
+            return super().search(term, limit, offset, answers)
+
+        columns = '{question answer}' if answers else '{question}'
+        params = {
+            'query': columns + ': "' + term.replace('"', '""') + '"',
+            'limit': limit,
+            'offset': offset,
+        }
+        rows = db.session.execute(text(
+            SELECT_QUESTIONS +
+            'FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid '
+            'WHERE questions_fts MATCH :query '
+            'ORDER BY bm25(questions_fts), q.id LIMIT :limit OFFSET :offset')
+            .execution_options(ranked=True), params)
+        total = db.session.execute(text(
+            'SELECT count(*) FROM questions_fts WHERE questions_fts MATCH :query'),
+            params).scalar()
+        return [dict(zip(QUESTION_FIELDS, row)) for row in rows], total
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+class QuestionSearch:
+    """
+    Picks the best search backend for the bound database. The index is
+    built by create_index (flask init-db); until it exists, or when it
+    can't be created (missing pg_trgm privileges, SQLite without FTS5),
+    searches use plain ILIKE.
+    """
+
+    def __init__(self):
+        self.backend = LikeSearchBackend()
+        self.name = None
+
+    def init_app(self, app):
+        self.name = app.config.get('SEARCH_BACKEND')
+        with app.app_context():
+            self.backend = self.find_backend(app.logger)
+
+    def backend_class(self):
+        backend_class = BACKENDS.get(self.name or db.engine.dialect.name)
+        if self.name == 'like' or backend_class is None:
+            return None
+        return backend_class
+
+    def find_backend(self, logger):
+        backend_class = self.backend_class()
+        if backend_class is not None:
+            try:
+                with db.engine.connect() as connection:
+                    if backend_class().available(connection):
+                        return backend_class()
+                logger.info('search index missing, using ILIKE until flask init-db builds it')
+            except SQLAlchemyError as error:
+                logger.warning('search index unavailable, using ILIKE: %s', error)
+        return LikeSearchBackend()
+
+    def create_index(self):
+        """Builds the index of the backend, returns False when it can't."""
+        backend_class = self.backend_class()
+        if backend_class is None:
+            return False
+        try:
+            with db.engine.begin() as connection:
+                backend_class().setup(connection)
+        except SQLAlchemyError as error:
+            current_app.logger.warning('search index unavailable, using ILIKE: %s', error)
+            return False
+        self.backend = backend_class()
+        return True
+
+    def search(self, term, limit, offset=0, answers=False):
+        return self.backend.search(term, limit, offset, answers)
+
+
+question_search = QuestionSearch()
@@ -0,0 +1,269 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import select
+
+from models import db, Question, Category, on_commit
+from flaskr.cache import search_cache
+from flaskr.http_cache import data_version
+from flaskr.reads import QUESTION_FIELDS
+
+# reload anyway after this many seconds, for writes of other processes
+QUESTION_SNAPSHOT_REFRESH = 300
+# difficulty is nullable and not range checked: the values are kept in
+# a 64 bit array with a separate null mask, null rows are listed under
+# this key, which no ?difficulty= can ask for
+NO_DIFFICULTY = 'null'
+# joins the texts, a search term can't match across two questions
+SEPARATOR = '\x00'
+
+
+class TextColumn:
+    """
+    Strings kept as one joined str plus an array of start offsets:
+    one object for the whole column instead of one per row.
+    """
+
+    def __init__(self, values):
+        self.blob = SEPARATOR.join(values)
+        self.offsets = array('q', [0])
+        for value in values:
+            self.offsets.append(self.offsets[-1] + len(value) + 1)
+
+    def __getitem__(self, position):
+        return self.blob[self.offsets[position]:self.offsets[position + 1] - 1]
+
+    def find(self, needle):
+        """Positions of the values containing needle, in order."""
+        positions = []
+        start = self.blob.find(needle)
+        while start >= 0:
+            position = bisect_right(self.offsets, start) - 1
+            positions.append(position)
+            # one hit per value, go on from the next one
+            start = self.blob.find(needle, self.offsets[position + 1])
+        return positions
+
+
+class Snapshot:
+    """
+    Immutable columnar copy of the question bank. Rows are sorted by id,
+    a row is a position in the columns. Every category (and category and
+    difficulty) listing is a precomputed array of positions, in id order
+    and in difficulty order, so any page is a slice.
+    """
+
+    def __init__(self, version, last_modified, questions, categories):
+        self.version = version
+        self.last_modified = last_modified
+        self.loaded_at = time.monotonic()
+        self.categories = categories
+        self.ids = array('q', (row[0] for row in questions))
+        self.difficulties = array('q', (row[3] or 0 for row in questions))
+        self.null_difficulties = bytearray(row[3] is None for row in questions)
+        self.category_ids = array('q', (row[4] for row in questions))
+        self.questions = TextColumn([row[1] or '' for row in questions])
+        self.answers = TextColumn([row[2] or '' for row in questions])
+        # searches are case insensitive, like ILIKE
+        self.folded_questions = TextColumn([(row[1] or '').casefold() for row in questions])
+        self.folded_answers = TextColumn([(row[2] or '').casefold() for row in questions])
+
+        self.by_id = {(None, None): array('q', range(len(self.ids)))}
+        for position, (category, difficulty) in enumerate(zip(self.category_ids, self.difficulties)):
+            if self.null_difficulties[position]:
+                difficulty = NO_DIFFICULTY
+            for key in ((category, None), (category, difficulty), (None, difficulty)):
+                self.by_id.setdefault(key, array('q')).append(position)
+        self.by_difficulty = {}
+        for key, positions in self.by_id.items():
+            if key[1] is None:
+                self.by_difficulty[key] = array('q', sorted(
+                    positions, key=self.difficulty_order))
+
+    def difficulty_order(self, position):
+        # nulls first, like ORDER BY difficulty on SQLite
+        return (not self.null_difficulties[position], self.difficulties[position], self.ids[position])
+
+    @classmethod
+    def load(cls, version, last_modified):
+        questions = db.session.execute(
+            select(Question.id, Question.question, Question.answer, Question.difficulty, Question.category)
+            .order_by(Question.id).execution_options(full_scan=True)).all()
+        categories = {}
+        for category_id, category_type in db.session.execute(
+                select(Category.id, Category.type).order_by(Category.id)):
+            categories[category_id] = category_type
+        return cls(version, last_modified, questions, categories)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def value(self, field, position):
+        if field == 'id':
+            return self.ids[position]
+        if field == 'question':
+            return self.questions[position]
+        if field == 'answer':
+            return self.answers[position]
+        if field == 'category':
+            return self.category_ids[position]
+        return None if self.null_difficulties[position] else self.difficulties[position]
+
+    def rows(self, positions, fields=QUESTION_FIELDS):
+        # same dicts as question_rows, in the same sorted key order
+        return [{field: self.value(field, position) for field in fields} for position in positions]
+
+    def position(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+        return None
+
+    def by_ids(self, question_ids, fields=QUESTION_FIELDS):
+        positions = [self.position(question_id) for question_id in question_ids]
+        return self.rows([position for position in positions if position is not None], fields)
+
+    def listing(self, category=None, difficulty=None, sort='id'):
+        """The questions of the category (None is all) sorted like QUESTION_SORTS."""
+        positions = self.by_id.get((category, difficulty), array('q'))
+        if sort in ('difficulty', '-difficulty') and difficulty is None:
+            positions = self.by_difficulty.get((category, None), array('q'))
+        return SnapshotListing(self, positions, sort.startswith('-'))
+
+    def total(self, category=None, difficulty=None):
+        return len(self.by_id.get((category, difficulty), ()))
+
+    def counts(self):
+        return {category: self.total(category) for category in self.categories}
+
+    def search(self, term, limit, offset=0, answers=False):
+        """Substring search over the question (and answer) text, in id order."""
+        needle = term.casefold()
+        positions = self.folded_questions.find(needle)
+        if answers:
+            positions = sorted(set(positions).union(self.folded_answers.find(needle)))
+        return self.rows(positions[offset:offset + limit]), len(positions)
+
+    def export_rows(self, category=None, difficulty=None):
+        # the tuples of export.EXPORT_COLUMNS
+        for position in self.by_id.get((category, difficulty), ()):
+            yield (self.ids[position], self.questions[position], self.answers[position],
+                   self.value('difficulty', position), self.category_ids[position])
+
+
+class SnapshotListing:
+
+    def __init__(self, snapshot, positions, descending=False):
+        self.snapshot = snapshot
+        self.positions = positions
+        self.descending = descending
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _slice(self, start, stop):
+        if not self.descending:
+            return self.positions[start:stop]
+        size = len(self.positions)
+        return self.positions[max(size - stop, 0):max(size - start, 0)][::-1]
+
+    def rows(self, start, count, fields=QUESTION_FIELDS):
+        return self.snapshot.rows(self._slice(start, start + count), fields)
+
+    def after(self, after, count, fields=QUESTION_FIELDS):
+        """Keyset page: the rows after the id, listings sorted by id only."""
+        start = 0
+        if after is not None:
+            ids = self.snapshot.ids
+            if self.descending:
+                start = len(self.positions) - bisect_left(self.positions, after, key=ids.__getitem__)
+            else:
+                start = bisect_right(self.positions, after, key=ids.__getitem__)
+        return self.rows(start, count, fields)
+
+
+class QuestionSnapshot:
+    """
+    Optional serving mode (QUESTION_SNAPSHOT): the reads are answered from
+    an in-memory Snapshot instead of the database. It is loaded when the
+    app starts, then a background thread builds a new one after every
+    commit and every QUESTION_SNAPSHOT_REFRESH seconds and swaps it in
+    with a single assignment. Readers keep the Snapshot they started
+    with. The HTTP validators follow the version being served, not the
+    latest commit.
+    """
+
+    def __init__(self):
+        self.refresh = QUESTION_SNAPSHOT_REFRESH
+        self.rebuilds = 0
+        self.rebuild_seconds = 0.0
+        self._snapshot = None
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.stop()
+        self.refresh = app.config.get('QUESTION_SNAPSHOT_REFRESH', self.refresh)
+        if not app.config.get('QUESTION_SNAPSHOT', False):
+            return
+        with app.app_context():
+            self.rebuild()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, args=(app, self._stop),
+                                        name='question-snapshot', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        self._snapshot = None
+        self._changed.clear()
+        data_version.unpin()
+
+    def get(self):
+        """The current Snapshot, None when the reads go to the database."""
+        return self._snapshot
+
+    def changed(self):
+        if self._thread is not None:
+            self._changed.set()
+
+    def rebuild(self):
+        # the version is read first, the rows loaded after include at least it
+        version, last_modified = data_version.value, data_version.last_modified
+        started = time.perf_counter()
+        snapshot = Snapshot.load(version, last_modified)
+        self._snapshot = snapshot
+        data_version.pin(version, last_modified)
+        # pages cached from the previous snapshot are stale
+        search_cache.invalidate()
+        self.rebuilds += 1
+        self.rebuild_seconds = time.perf_counter() - started
+        return snapshot
+
+    def run(self, app, stop):
+        while not stop.is_set():
+            self._changed.wait(self.refresh or None)
+            if stop.is_set():
+                return
+            # commits made while rebuilding trigger one more rebuild
+            self._changed.clear()
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception:
+                app.logger.exception('question snapshot rebuild failed, serving the previous one')
+
+
+question_snapshot = QuestionSnapshot()
+
+
+@on_commit
+def rebuild_snapshot(changes):
+    question_snapshot.changed()
@@ -0,0 +1,228 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, on_commit
+
+SUGGEST_INDEX_TTL = 600
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 25
+# candidates checked against the other query words before giving up
+MAX_SUGGEST_SCAN = 2000
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN.findall((text or '').casefold())
+
+
+def build_index(rows):
+    """(sorted words, {word: {id: None}}, {id: text}) of the (id, text) rows."""
+    postings = {}
+    questions = {}
+    for question_id, text in rows:
+        questions[question_id] = text
+        for word in set(tokenize(text)):
+            # dicts keep insertion order and remove in O(1)
+            postings.setdefault(word, {})[question_id] = None
+    return sorted(postings), postings, questions
+
+
+def matches(words, tokens):
+    # every query word is the start of some word of the question
+    return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+class SuggestIndex:
+    """
+    In-memory prefix index over the words of the question texts, for
+    typeahead. The vocabulary is a sorted list, the words starting with a
+    prefix are one bisect away (what a trie gives, without a dict per
+    character), and each word maps to the ids of the questions using it.
+    The query word matching the fewest questions drives the scan, the
+    others are checked on its candidates. Questions whose word equals
+    that prefix come first, then the longer words in alphabetical order. Built when the app starts and kept in
+    sync by the commit listener. After ttl seconds a background thread
+    rebuilds it, to pick up writes of other processes, and swaps it in:
+    requests never wait for a rebuild.
+    """
+
+    def __init__(self, ttl=SUGGEST_INDEX_TTL):
+        self.ttl = ttl
+        self.app = None
+        self._words = None
+        self._postings = None
+        self._questions = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._refreshing = False
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SUGGEST_INDEX_TTL', self.ttl)
+        self.app = app
+        self.invalidate()
+        with app.app_context():
+            try:
+                self.load()
+            except SQLAlchemyError:
+                # no schema yet (before flask init-db), built on first use
+                db.session.rollback()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._words = None
+
+    def load(self):
+        """Builds a new index from the database, off the lock, and swaps it in."""
+        with self._lock:
+            generation = self._generation
+        rows = db.session.execute(
+            select(Question.id, Question.question).execution_options(full_scan=True, primary=True)).all()
+        words, postings, questions = build_index(rows)
+        with self._lock:
+            if generation != self._generation and self._words is not None:
+                # the current index has commits this load may have missed, keep it
+                # until the next refresh
+                return
+            self._words, self._postings, self._questions = words, postings, questions
+            # a first load that raced with commits is refreshed right away
+            self._loaded_at = time.monotonic() if generation == self._generation else 0
+
+    def expire(self):
+        """Rebuilds the index in the background, the current one is served meanwhile."""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = 0
+            loaded = self._words is not None
+        if loaded:
+            self.refresh()
+
+    def _ensure_loaded(self):
+        if self._words is None:
+            # not built at startup, or invalidated
+            self.load()
+        elif time.monotonic() - self._loaded_at >= self.ttl:
+            self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            if self._refreshing or self.app is None:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, args=(self.app,), name='suggest-index', daemon=True).start()
+
+    def _refresh(self, app):
+        try:
+            with app.app_context():
+                self.load()
+        except Exception:
+            app.logger.exception('suggest index rebuild failed, serving the previous one')
+            self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _add(self, question_id, text):
+        if question_id in self._questions:
+            self._remove(question_id)
+        self._questions[question_id] = text
+        for word in set(tokenize(text)):
+            ids = self._postings.get(word)
+            if ids is None:
+                ids = self._postings[word] = {}
+                insort(self._words, word)
+            ids[question_id] = None
+
+    def _remove(self, question_id):
+        text = self._questions.pop(question_id, None)
+        if text is None:
+            return
+        for word in set(tokenize(text)):
+            ids = self._postings[word]
+            del ids[question_id]
+            if not ids:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
+
+    def add(self, question_id, text):
+        with self._lock:
+            # a load running now may have missed it
+            self._generation += 1
+            if self._words is not None:
+                self._add(question_id, text)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._generation += 1
+            if self._words is not None:
+                self._remove(question_id)
+
+    def _count(self, prefix, bound):
+        # questions having a word that starts with prefix (counted once per
+        # word), stops as soon as it is over bound
+        count = 0
+        position = bisect_left(self._words, prefix)
+        while count <= bound and position < len(self._words) and self._words[position].startswith(prefix):
+            count += len(self._postings[self._words[position]])
+            position += 1
+        return count
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """
+        Returns up to limit {'id', 'question'} dicts of the questions
+        having a word that starts with each word of the query.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            # scan the candidates of the rarest word, on ties the longest one
+            prefix, bound = None, len(self._questions)
+            for word in sorted(set(words), key=lambda word: (-len(word), word)):
+                count = self._count(word, bound)
+                if prefix is None or count < bound:
+                    prefix, bound = word, count
+            others = [word for word in words if word != prefix]
+            suggestions = []
+            found = set()
+            scanned = 0
+            position = bisect_left(self._words, prefix)
+            while position < len(self._words) and self._words[position].startswith(prefix):
+                for question_id in self._postings[self._words[position]]:
+                    if question_id in found:
+                        continue
+                    found.add(question_id)
+                    text = self._questions[question_id]
+                    if not others or matches(others, tokenize(text)):
+                        suggestions.append({'id': question_id, 'question': text})
+                        if len(suggestions) == limit:
+                            return suggestions
+                    scanned += 1
+                    if scanned >= MAX_SUGGEST_SCAN:
+                        return suggestions
+                position += 1
+            return suggestions
+
+
+suggest_index = SuggestIndex()
+
+
+@on_commit
+def update_suggest_index(changes):
+    for table, action, row in changes:
+        if table != 'questions':
+            continue
+        if action == 'import':
+            # the imported texts are not in the changes
+            suggest_index.expire()
+        elif action == 'delete':
+            suggest_index.remove(row['id'])
+        else:
+            suggest_index.add(row['id'], row['question'])
@@ -1,7 +1,12 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine, ForeignKey
-from sqlalchemy.orm import relationship
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context
+from sqlalchemy import Column, String, Integer, Index, create_engine, ForeignKey, event, inspect, make_url
+from sqlalchemy.orm import relationship, Session
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 import json
 from dotenv import load_dotenv
 
@@ -13,20 +18,217 @@ DB_HOST = os.environ.get("DB_HOST")
 
 database_name = 'trivia'
 database_path = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD,DB_HOST, database_name)
+# DATABASE_URL overrides the postgres settings, e.g. sqlite:///trivia.db for local runs
+database_path = os.environ.get("DATABASE_URL", database_path)
 
-db = SQLAlchemy()
+# optional read replica, same credentials and database name as the primary
+DB_REPLICA_HOST = os.environ.get("DB_REPLICA_HOST")
+replica_path = None
+if DB_REPLICA_HOST:
+    replica_path = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_REPLICA_HOST, database_name)
+replica_path = os.environ.get("DATABASE_REPLICA_URL", replica_path)
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+# (config or environment variable, create_engine argument, parser)
+POOL_SETTINGS = (
+    ('DB_POOL_SIZE', 'pool_size', int),
+    ('DB_MAX_OVERFLOW', 'max_overflow', int),
+    ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+    ('DB_POOL_RECYCLE', 'pool_recycle', int),
+    ('DB_POOL_PRE_PING', 'pool_pre_ping', parse_bool),
+)
+
+"""
+Pool checkouts
+    functions registered with on_checkout(listener) are called with the
+    bind name (PRIMARY or REPLICA) and the seconds a checkout waited for
+    a connection, including checkouts that timed out.
+"""
+checkout_listeners = []
+
+
+def on_checkout(listener):
+    checkout_listeners.append(listener)
+    return listener
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool timing how long each checkout waits for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            for listener in checkout_listeners:
+                listener(self.logging_name or PRIMARY, waited)
+
+
+def pool_options(config, path, name=PRIMARY):
+    """create_engine arguments of the pool, from the app config or the environment."""
+    url = make_url(path)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # one shared connection (StaticPool), nothing to size
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_logging_name': name,
+        # a failover leaves dead connections in the pool, test them on checkout.
+        # sqlite files can't go away under us
+        'pool_pre_ping': url.get_backend_name() != 'sqlite',
+    }
+    for key, option, parse in POOL_SETTINGS:
+        value = config.get(key, os.environ.get(key))
+        if value is not None:
+            options[option] = parse(value)
+    return options
+
+
+def reads_from_replica():
+    return has_request_context() and g.get('read_replica', False)
+
+
+@contextmanager
+def replica_reads():
+    """Lets the SELECTs of the block go to the replica, like a GET request."""
+    previous = g.get('read_replica', False)
+    g.read_replica = True
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+
+def replica_statement(session, clause):
+    """
+    True for the SELECTs of read-only requests (GET, or a replica_reads
+    block). Flushes and every other statement go to the primary, and so
+    do the statements that must see the latest commit: they opt out with
+    .execution_options(primary=True).
+    """
+    return (not session._flushing and reads_from_replica()
+            and clause is not None and clause.is_select
+            and not clause.get_execution_options().get('primary', False))
+
+
+class RoutingSession(FlaskSession):
+    """Sends replica_statement()s to the replica bind when there is one."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and replica_statement(self, clause):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. Tables are not
+    created here, run flask init-db once (see flaskr.init_db). The pool
+    settings come from POOL_SETTINGS, replica_path adds the replica bind.
+    SQLALCHEMY_ENGINE_OPTIONS in the app config override both.
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_path=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(
+        pool_options(app.config, database_path), **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if replica_path:
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds[REPLICA] = dict(pool_options(app.config, replica_path, REPLICA), url=replica_path)
+        app.config["SQLALCHEMY_BINDS"] = binds
     db.app = app
     with db.app.app_context():
         db.init_app(app)
-        db.create_all()
+
+"""
+Change tracking
+    functions registered with on_commit(listener) are called after every
+    commit that wrote questions or categories. The listener receives the
+    list of changes as (table, action, row) tuples, action is 'insert',
+    'update' or 'delete' and row is the formatted row. Bulk imports
+    record one 'import' change per batch instead, its row is
+    {'counts': {(category, difficulty): inserted questions}}: listeners
+    keeping per question state reload it.
+"""
+commit_listeners = []
+
+
+def on_commit(listener):
+    commit_listeners.append(listener)
+    return listener
+
+
+def track_change(session, table, action, row):
+    session.info.setdefault('changes', []).append((table, action, row))
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changes(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, (Question, Category)):
+            track_change(session, obj.__tablename__, 'insert', obj.format())
+    for obj in session.dirty:
+        if isinstance(obj, (Question, Category)) and session.is_modified(obj):
+            row = obj.format()
+            if isinstance(obj, Question):
+                # listeners keeping per category state need the old values
+                attrs = inspect(obj).attrs
+                for field in ('category', 'difficulty'):
+                    previous = getattr(attrs, field).history.deleted
+                    row['previous_' + field] = previous[0] if previous else getattr(obj, field)
+            track_change(session, obj.__tablename__, 'update', row)
+    for obj in session.deleted:
+        if isinstance(obj, (Question, Category)):
+            track_change(session, obj.__tablename__, 'delete', obj.format())
+
+
+@event.listens_for(Session, 'after_commit')
+def notify_changes(session):
+    # releasing a savepoint is not the end of the transaction
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop('changes', None)
+    if changes:
+        for listener in commit_listeners:
+            listener(changes)
+
+
+@event.listens_for(Session, 'after_transaction_create')
+def mark_savepoint(session, transaction):
+    if transaction.nested:
+        savepoints = session.info.setdefault('savepoints', {})
+        savepoints[transaction] = len(session.info.get('changes', ()))
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def forget_savepoints(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('savepoints', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_changes(session, previous_transaction):
+    if previous_transaction.nested:
+        # only drop what was written inside the savepoint
+        mark = session.info.get('savepoints', {}).get(previous_transaction)
+        if mark is not None and 'changes' in session.info:
+            del session.info['changes'][mark:]
+    else:
+        session.info.pop('changes', None)
 
 """
 Question
@@ -34,6 +236,11 @@ Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # category listings: filter by category (and difficulty), order by id
+        Index('ix_questions_category_difficulty_id', 'category', 'difficulty', 'id'),
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
@@ -67,6 +274,14 @@ class Question(db.Model):
             'difficulty': self.difficulty
             }
 
+
+@event.listens_for(Question.category, 'set', active_history=True)
+@event.listens_for(Question.difficulty, 'set', active_history=True)
+def keep_previous_value(target, value, oldvalue, initiator):
+    # active_history loads the old value of an expired attribute before it
+    # is replaced, so collect_changes can report previous_category/difficulty
+    pass
+
 """
 Category
 
@@ -0,0 +1,171 @@
+import re
+from datetime import datetime, timezone
+
+from flask import has_request_context, request
+from sqlalchemy import Column, DateTime, MetaData, String, Table, event, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Question
+
+"""
+Migrations
+    indexes are declared on the models, create_all only adds them with
+    new tables. MIGRATIONS are the ordered steps that bring an existing
+    database up to date, each one is recorded in schema_migrations once
+    applied. Steps must be safe to run twice (checkfirst, IF NOT EXISTS):
+    two workers starting together may both run one.
+"""
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('name', String, primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def create_indexes(table):
+    def step(connection):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    return step
+
+
+MIGRATIONS = [
+    ('0001_questions_category_indexes', create_indexes(Question.__table__)),
+]
+
+
+def upgrade(engine):
+    """Applies the pending migrations, returns the names of the ones applied."""
+    try:
+        with engine.begin() as connection:
+            schema_migrations.create(connection, checkfirst=True)
+            applied = set(connection.scalars(select(schema_migrations.c.name)))
+            pending = [(name, step) for name, step in MIGRATIONS if name not in applied]
+            for name, step in pending:
+                step(connection)
+                connection.execute(schema_migrations.insert().values(
+                    name=name, applied_at=datetime.now(timezone.utc)))
+    except IntegrityError:
+        # another worker recorded the same migration first
+        return []
+    return [name for name, step in pending]
+
+
+"""
+Query plan checks
+    QueryPlanCheck records the statements an engine runs for requests
+    while it is active and EXPLAINs them afterwards. full_scans() returns
+    the plan lines showing a missing index: a table read without an
+    index (SCAN on SQLite, Seq Scan or a primary key scan with a Filter
+    on postgres, with enable_seqscan off so small test tables don't hide
+    a missing index), and pages that sort every matching row before
+    their LIMIT. Queries meant to read everything (exports) opt out
+    with .execution_options(full_scan=True), ranked searches, which have
+    to sort their matches by relevance, with ranked=True.
+"""
+# lookup tables small enough that a scan is the right plan
+SMALL_TABLES = ('categories',)
+EXPLAINED = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)$')
+SQLITE_SORT = re.compile(r'^USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY$')
+LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+POSTGRES_PKEY_SCAN = re.compile(r'Index (Only )?Scan (Backward )?using \w+_pkey on (\w+)')
+POSTGRES_SORT = re.compile(r'^(-> +)?Sort ')
+
+
+def scans_of(pattern, plan):
+    scans = []
+    for line in plan:
+        match = pattern.search(line)
+        if match and match.group(1) not in SMALL_TABLES:
+            scans.append(line)
+    return scans
+
+
+def sqlite_scans(connection, statement, parameters, ranked=False):
+    # EXPLAIN doesn't check the schema, a plan the driver cached before an
+    # index was created or dropped would still be used: key it on the version
+    version = connection.exec_driver_sql('PRAGMA schema_version').scalar()
+    plan = [row[3] for row in connection.exec_driver_sql(
+        '/* schema {} */ EXPLAIN QUERY PLAN {}'.format(version, statement), parameters)]
+    # compiled statements break lines before their clauses
+    limited = LIMIT.search(statement) is not None
+    sorts = [detail for detail in plan if SQLITE_SORT.match(detail)]
+    if ranked:
+        sorts = []
+    # reading the table in rowid order stops after the page, but only
+    # when no row is filtered out or sorted before the LIMIT
+    if limited and not WHERE.search(statement) and not sorts:
+        return []
+    return scans_of(SQLITE_SCAN, plan) + (sorts if limited else [])
+
+
+def postgres_scans(connection, statement, parameters, ranked=False):
+    connection.exec_driver_sql('SET enable_seqscan = off')
+    try:
+        plan = [row[0].strip() for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+    finally:
+        connection.exec_driver_sql('RESET enable_seqscan')
+    scans = scans_of(POSTGRES_SCAN, plan)
+    limited = bool(plan) and plan[0].startswith('Limit')
+    node = None
+    for number, line in enumerate(plan):
+        if number == 0 or line.startswith('->'):
+            node = line
+            if limited and not ranked and POSTGRES_SORT.match(line):
+                scans.append(line)
+        elif line.startswith('Filter:'):
+            # the planner walks the primary key and filters the rows instead of using an index
+            match = POSTGRES_PKEY_SCAN.search(node)
+            if match and match.group(3) not in SMALL_TABLES:
+                scans.append('{} {}'.format(node, line))
+    return scans
+
+
+PLAN_CHECKS = {
+    'sqlite': sqlite_scans,
+    'postgresql': postgres_scans,
+}
+
+
+class QueryPlanCheck:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self.record)
+
+    def record(self, connection, cursor, statement, parameters, context, executemany):
+        # only the queries routes make, not the ones of test fixtures
+        if not has_request_context() or executemany or context.execution_options.get('full_scan'):
+            return
+        if not statement.lstrip().upper().startswith(EXPLAINED):
+            return
+        self.statements.append((request.endpoint, statement, parameters,
+                                context.execution_options.get('ranked', False)))
+
+    def full_scans(self):
+        """Returns (endpoint, statement, plan line) for every full table scan."""
+        check = PLAN_CHECKS.get(self.engine.dialect.name)
+        if check is None:
+            return []
+        scans = []
+        explained = set()
+        # the session's connection sees the rows of a test transaction
+        connection = db.session.connection()
+        for endpoint, statement, parameters, ranked in self.statements:
+            key = (endpoint, statement, repr(parameters))
+            if key in explained:
+                continue
+            explained.add(key)
+            for line in check(connection, statement, parameters, ranked):
+                scans.append((endpoint, statement, line))
+        return scans
@@ -1,42 +1,227 @@
 import os
+import re
+import asyncio
+import tempfile
+import time
+import gzip
 from unicodedata import category
 import unittest
+from unittest import mock
 import json
 from urllib import request
-from flask_sqlalchemy import SQLAlchemy
+from urllib.parse import unquote
+from flask import Response, jsonify
+from sqlalchemy import create_engine, delete, event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr import create_app, init_db
+from flaskr.asgi import AsyncTrivia
+from models import db, Question, Category, REPLICA, TimedQueuePool, pool_options, replica_reads
+from flaskr.metrics import metrics
+from flaskr.profiler import profiler
+from flaskr.cache import category_cache, search_cache, SearchCache
+from flaskr.compression import response_cache
+from flaskr.counts import question_counts
+from flaskr.quiz import question_index
+from flaskr import suggest
+from flaskr.suggest import suggest_index
+from schema import QueryPlanCheck, upgrade
+from flaskr.snapshot import question_snapshot
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-DB_USER = os.environ.get("DB_USER")
-DB_PASSWORD = os.environ.get("DB_PASSWORD")
-DB_HOST = os.environ.get("DB_HOST")
+# in-memory SQLite by default, TEST_DATABASE_URL runs the suite on a real
+# server (e.g. the postgres trivia_test database)
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+# TEST_ASGI=1 sends the requests through flaskr.asgi and its async engine
+TEST_ASGI = os.environ.get('TEST_ASGI')
+PROFILER_TOKEN = 'test-profiler-token'
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+
+
+def fixture_rows(table):
+    """The rows of the COPY block of the table in trivia.psql."""
+    with open(FIXTURE) as dump:
+        match = re.search(r'COPY public\.%s \((.*?)\) FROM stdin;\n(.*?)\n\\\.' % table, dump.read(), re.S)
+    columns = match.group(1).split(', ')
+    return [dict(zip(columns, line.split('\t'))) for line in match.group(2).split('\n')]
+
+
+def seed_database():
+    if db.session.query(Category.id).first() is not None:
+        return
+    db.session.execute(insert(Category), [
+        {'id': int(row['id']), 'type': row['type']} for row in fixture_rows('categories')])
+    db.session.execute(insert(Question), [
+        {'id': int(row['id']), 'question': row['question'], 'answer': row['answer'],
+         'difficulty': int(row['difficulty']), 'category': int(row['category'])}
+        for row in fixture_rows('questions')])
+    db.session.commit()
+
+
+def begin_sqlite_transaction(connection):
+    # engine.begin() inside a test joins the test transaction
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+
+
+class AsgiTestClient:
+    """The subset of the Flask test client the tests use, over an ASGI app."""
+
+    def __init__(self, app, loop):
+        self.app = app
+        self.loop = loop
+
+    def open(self, path, method='GET', json=None, data=None, headers=None, content_type=None):
+        path, _, query = path.partition('?')
+        if json is not None:
+            data = globals()['json'].dumps(json)
+            content_type = 'application/json'
+        body = data.encode('utf-8') if isinstance(data, str) else data or b''
+        headers = dict(headers or {}, Host='localhost')
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method, 'path': unquote(path), 'raw_path': path.encode('utf-8'),
+            'query_string': query.encode('utf-8'), 'root_path': '',
+            'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.app(scope, receive, send))
+        start = messages[0]
+        return Response(b''.join(message.get('body', b'') for message in messages[1:]), status=start['status'],
+                        headers=[(name.decode('latin-1'), value.decode('latin-1')) for name, value in start['headers']])
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, 'PATCH', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, 'DELETE', **kwargs)
+
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """One app and one engine for the whole suite, the schema and the fixture are loaded once."""
+        cls.profiles = tempfile.TemporaryDirectory()
+        config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URL,
+                  'PROFILER_TOKEN': PROFILER_TOKEN, 'PROFILE_DIR': cls.profiles.name}
+        if TEST_DATABASE_URL.startswith('sqlite'):
+            # pysqlite begins transactions on its own and can't nest them,
+            # hand that to SQLAlchemy so the tests can use savepoints
+            config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'isolation_level': None}}
+        cls.app = create_app(config)
+        with cls.app.app_context():
+            if TEST_DATABASE_URL.startswith('sqlite'):
+                event.listen(db.engine, 'begin', begin_sqlite_transaction)
+            init_db()
+            seed_database()
+            if TEST_ASGI:
+                cls.start_asgi()
+        cls.session = db.session
+        # the same scope as the Flask-SQLAlchemy session, but a plain
+        # session: it is bound to the connection of the test below
+        db.session = scoped_session(sessionmaker(join_transaction_mode='create_savepoint'),
+                                    scopefunc=cls.session.registry.scopefunc)
+
+    @classmethod
+    def start_asgi(cls):
+        # only needed in this mode
+        import aiosqlite
+
+        if not TEST_DATABASE_URL.startswith('sqlite'):
+            raise unittest.SkipTest('TEST_ASGI runs on the in-memory SQLite database')
+        with db.engine.connect() as connection:
+            shared = connection.connection.driver_connection
+
+        async def connect():
+            # aiosqlite on the sqlite connection of the sync engine: both
+            # see the rows of the test transaction
+            return await aiosqlite.Connection(lambda: shared, 64)
+
+        cls.loop = asyncio.new_event_loop()
+        engine = create_async_engine('sqlite+aiosqlite://', async_creator=connect, poolclass=StaticPool)
+        event.listen(engine.sync_engine, 'begin', begin_sqlite_transaction)
+        cls.asgi = AsyncTrivia(cls.app, engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session = cls.session
+        cls.profiles.cleanup()
+        if TEST_ASGI:
+            cls.loop.run_until_complete(cls.asgi.close())
+            cls.loop.close()
+
+    def plan_engine(self):
+        # the engine the routes run their queries on
+        if TEST_ASGI:
+            return self.asgi.engine.sync_engine
+        with self.app.app_context():
+            return db.engine
+
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Every test runs in a transaction rolled back by tearDown, the commits of the app release savepoints."""
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgresql://{}:{}@{}/{}".format(DB_USER, DB_PASSWORD, DB_HOST, self.database_name)
-
-        # binds the app to the current context
         with self.app.app_context():
-            setup_db(self.app, self.database_path)
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
+            self.connection = db.engine.connect()
+            self.transaction = self.connection.begin()
+            # sessions live as long as an app context, the next ones use the connection
+            db.session.configure(bind=self.connection)
+        if TEST_ASGI:
+            # the requests join the test transaction through the async side of the connection
+            self.client = lambda: AsgiTestClient(self.asgi, self.loop)
+            self.async_connection = self.loop.run_until_complete(self.asgi.engine.connect())
+            self.async_transaction = self.loop.run_until_complete(self.async_connection.begin())
+            self.asgi.sessions = async_sessionmaker(self.async_connection, join_transaction_mode='create_savepoint')
+        # the in-memory state followed the rolled back commits of the previous test
+        for cache in (category_cache, search_cache, response_cache, question_counts, question_index, suggest_index):
+            cache.invalidate()
+        self.start_plan_check()
+
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        try:
+            self.stop_plan_check()
+        finally:
+            if TEST_ASGI:
+                self.loop.run_until_complete(self.async_transaction.rollback())
+                self.loop.run_until_complete(self.async_connection.close())
+            self.transaction.rollback()
+            self.connection.close()
+
+    def start_plan_check(self):
+        # EXPLAIN_QUERIES=1 fails any test whose queries scan a whole table
+        self.plan_check = None
+        if os.environ.get('EXPLAIN_QUERIES'):
+            with self.app.app_context():
+                self.plan_check = QueryPlanCheck(self.plan_engine()).__enter__()
+
+    def stop_plan_check(self):
+        if getattr(self, 'plan_check', None) is not None:
+            self.plan_check.__exit__(None, None, None)
+            with self.app.app_context():
+                self.assertEqual(self.plan_check.full_scans(), [])
 
     def test_base_url(self):
         req = self.client().get('/api')
@@ -45,6 +230,102 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(req.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['message']))
+    def test_metrics(self):
+        req = self.client().get('/api/questions')
+
+        self.assertIn('app;dur=', req.headers['Server-Timing'])
+        self.assertIn('queries', req.headers['Server-Timing'])
+
+        req = self.client().get('/api/metrics')
+        body = req.data.decode('utf-8')
+
+        self.assertEqual(req.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="getPaginatedQuestions"}', body)
+        self.assertIn('trivia_responses_total{endpoint="getPaginatedQuestions",method="GET",status="200"}', body)
+        self.assertIn('trivia_request_sql_statements_bucket{endpoint="getPaginatedQuestions",le="+Inf"}', body)
+        self.assertIn('trivia_category_cache_hits_total', body)
+
+    def test_pool_options(self):
+        options = pool_options({'DB_POOL_SIZE': '20', 'DB_POOL_PRE_PING': 'false'}, 'postgresql://user:password@db/trivia')
+
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 20)
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertEqual(pool_options({'DB_POOL_SIZE': '20'}, 'sqlite://'), {})
+
+    def test_pool_checkout_metrics(self):
+        engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_logging_name=REPLICA)
+        before = metrics.checkouts[REPLICA].count
+        with engine.connect():
+            pass
+        engine.dispose()
+
+        self.assertEqual(metrics.checkouts[REPLICA].count, before + 1)
+        self.assertIn('trivia_db_pool_checkout_seconds_count{bind="replica"}', self.client().get('/api/metrics').data.decode('utf-8'))
+
+    def test_replica_routing(self):
+        replica = create_engine('sqlite://')
+        query = select(Question.id)
+        with self.app.app_context():
+            engines = db.engines
+            primary = db.engine
+        engines[REPLICA] = replica
+        try:
+            # every request gets its own app context, and so its own g and session.
+            # The suite's session is bound to the test transaction, check the app's own
+            with self.app.test_request_context('/api/questions'):
+                self.app.preprocess_request()
+                session = self.session()
+                self.assertIs(session.get_bind(clause=query), replica)
+                self.assertIs(session.get_bind(clause=query.execution_options(primary=True)), primary)
+                self.assertIs(session.get_bind(clause=delete(Question)), primary)
+            with self.app.test_request_context('/api/quizzes', method='POST'):
+                self.app.preprocess_request()
+                session = self.session()
+                self.assertIs(session.get_bind(clause=query), primary)
+                with replica_reads():
+                    self.assertIs(session.get_bind(clause=query), replica)
+        finally:
+            del engines[REPLICA]
+            replica.dispose()
+
+    def test_profile_request(self):
+        headers = {'X-Profile-Token': PROFILER_TOKEN}
+        req = self.client().get('/api/questions?page=2', headers=headers)
+        reportId = req.headers['X-Profile-Id']
+
+        self.assertNotIn('X-Profile-Id', self.client().get('/api/questions').headers)
+        self.assertNotIn('X-Profile-Id', self.client().get('/api/questions', headers={'X-Profile-Token': 'wrong'}).headers)
+        self.assertIn(reportId, json.loads(self.client().get('/api/profiles', headers=headers).data)['profiles'])
+
+        report = self.client().get('/api/profiles/' + reportId, headers=headers).data.decode('utf-8')
+        self.assertIn('GET /api/questions?page=2 -> 200', report)
+        self.assertIn('SELECT', report)
+        self.assertIn('paginated_questions', report)
+
+    def test_profile_endpoint_sampling(self):
+        headers = {'X-Profile-Token': PROFILER_TOKEN}
+        keep = profiler.keep
+        profiler.rates = {'getCategories': 1.0}
+        profiler.keep = 2
+        try:
+            reportIds = [self.client().get('/api/categories').headers['X-Profile-Id'] for i in range(3)]
+            self.assertNotIn('X-Profile-Id', self.client().get('/api/questions').headers)
+            profiles = json.loads(self.client().get('/api/profiles', headers=headers).data)['profiles']
+        finally:
+            profiler.rates = {}
+            profiler.keep = keep
+
+        self.assertEqual(profiles, reportIds[:0:-1])
+
+    def test_401_profiles(self):
+        req = self.client().get('/api/profiles')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 401)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(self.client().get('/api/profiles/missing', headers={'X-Profile-Token': PROFILER_TOKEN}).status_code, 404)
+
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
@@ -60,6 +341,39 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(len(data['categories']))
 
+    def test_paginate_questions_fields(self):
+        req = self.client().get('/api/questions?fields=id,question')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+
+        req = self.client().get('/api/questions?after=0&limit=2&fields=answer')
+        data = json.loads(req.data)
+
+        self.assertEqual(set(data['questions'][0]), {'answer'})
+        self.assertTrue(data['next_cursor'])
+
+    def test_400_paginate_questions_fields(self):
+        req = self.client().get('/api/questions?fields=id,password')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_paginate_questions_same_bytes_as_jsonify(self):
+        # question 16 has an en dash, add a character outside the BMP to its category
+        self.client().post('/api/questions', json={'question' : 'Which emoji is this: \U0001f600?', 'answer' : 'Grinning', 'category' : 2, 'difficulty' : 1})
+        for url in ('/api/questions?page=2', '/api/categories/2/questions'):
+            req = self.client().get(url)
+            with self.app.app_context():
+                expected = jsonify(json.loads(req.data)).data
+
+            self.assertIn(b'\\u', req.data)
+            self.assertEqual(req.data, expected)
+
     def test_404_paginate_questions(self):
         req = self.client().get('/api/questions?page=234040')
         data = json.loads(req.data)
@@ -68,6 +382,32 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'resource not found')
         self.assertEqual(data['success'], False)
 
+    def test_cursor_paginate_questions(self):
+        req = self.client().get('/api/questions?after=0&limit=3')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 3)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+
+        req = self.client().get('/api/questions?after={}&limit=3'.format(data['next_cursor']))
+        next_page = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertTrue(next_page['questions'][0]['id'] > data['next_cursor'])
+
+    def test_400_cursor_paginate_questions(self):
+        req = self.client().get('/api/questions?after=0&limit=0')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+        for url in ('/api/questions?after=abc', '/api/categories/2/questions?after='):
+            self.assertEqual(self.client().get(url).status_code, 400)
+
     def test_questions_by_category(self):
         req = self.client().get('/api/categories/3/questions')
         data = json.loads(req.data)
@@ -77,6 +417,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(data['current_category'], 3)
 
+    def test_questions_by_category_filtered(self):
+        req = self.client().get('/api/categories/2/questions?difficulty=3')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(question['difficulty'] == 3 for question in data['questions']))
+        self.assertEqual(data['total_questions'], len(data['questions']))
+
+        req = self.client().get('/api/categories/2/questions?sort=-difficulty')
+        data = json.loads(req.data)
+        difficulties = [question['difficulty'] for question in data['questions'] if question['difficulty'] is not None]
+
+        self.assertEqual(difficulties, sorted(difficulties, reverse=True))
+
+    def test_questions_by_category_cursor(self):
+        req = self.client().get('/api/categories/2/questions?after=0&limit=2')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(len(data['questions']), 2)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+
+        req = self.client().get('/api/categories/2/questions?after={}&limit=2'.format(data['next_cursor']))
+        next_page = json.loads(req.data)
+
+        self.assertTrue(next_page['questions'][0]['id'] > data['next_cursor'])
+
+    def test_400_questions_by_category(self):
+        req = self.client().get('/api/categories/2/questions?sort=answer')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_404_question_by_category(self):
         req = self.client().get('/api/categories/4550044/questions')
         data = json.loads(req.data)
@@ -95,6 +471,29 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(data['current_category'], 'All')
 
+    def test_search_question_answers(self):
+        req = self.client().post('/api/questions', json={'searchTerm' : 'maya angelou', 'searchAnswers' : True})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertEqual(data['questions'][0]['answer'], 'Maya Angelou')
+
+        req = self.client().post('/api/questions', json={'searchTerm' : 'maya angelou'})
+        data = json.loads(req.data)
+
+        self.assertEqual(data['total_questions'], 0)
+
+    def test_search_question_paginated(self):
+        req = self.client().post('/api/questions?page=2', json={'searchTerm' : ''})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertTrue(data['total_questions'] > 10)
+        self.assertEqual(data['current_category'], '')
+
     def test_200_search_questions_by_category(self):
         req = self.client().post('/api/questions', json={'searchTerm' : 'owodnjendjenw'})
         data = json.loads(req.data)
@@ -111,6 +510,94 @@ class TriviaTestCase(unittest.TestCase):
     #     self.assertEqual(req.status_code, 200)
     #     self.assertEqual(data['success'], True)
     
+    def test_suggest_questions(self):
+        req = self.client().get('/api/questions/suggest?q=autobio')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['suggestions']))
+        self.assertTrue(all('autobio' in suggestion['question'].lower() for suggestion in data['suggestions']))
+
+        with self.app.app_context():
+            question = Question('Which zyxwords are suggested?', 'New ones', 1, 1)
+            question.insert()
+            questionId = question.id
+        req = self.client().get('/api/questions/suggest?q=which zyxw')
+        data = json.loads(req.data)
+        self.assertEqual([suggestion['id'] for suggestion in data['suggestions']], [questionId])
+
+        with self.app.app_context():
+            db.session.get(Question, questionId).delete()
+        req = self.client().get('/api/questions/suggest?q=zyxw')
+        data = json.loads(req.data)
+        self.assertEqual(data['suggestions'], [])
+
+    def test_suggest_scans_the_rarest_word(self):
+        with self.app.app_context():
+            question = Question('Which zy is the rarest?', 'This one', 1, 1)
+            question.insert()
+            questionId = question.id
+        # 'which' is longer but in many questions, scanning it would stop before the new one
+        with mock.patch('flaskr.suggest.MAX_SUGGEST_SCAN', 1):
+            req = self.client().get('/api/questions/suggest?q=which zy')
+        data = json.loads(req.data)
+
+        self.assertEqual([suggestion['id'] for suggestion in data['suggestions']], [questionId])
+
+    def test_suggest_index_keeps_commits_made_while_loading(self):
+        self.client().get('/api/questions/suggest?q=autobio')
+        build = suggest.build_index
+
+        def commit_while_building(rows):
+            suggest_index.add(999999, 'Which zyxwords were committed meanwhile?')
+            return build(rows)
+
+        with self.app.app_context(), mock.patch('flaskr.suggest.build_index', commit_while_building):
+            suggest_index.load()
+        req = self.client().get('/api/questions/suggest?q=zyxw')
+        data = json.loads(req.data)
+
+        self.assertEqual([suggestion['id'] for suggestion in data['suggestions']], [999999])
+
+    def test_400_suggest_questions(self):
+        req = self.client().get('/api/questions/suggest?q=%20')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_export_questions(self):
+        req = self.client().get('/api/questions/export?category=2')
+        rows = [json.loads(line) for line in req.data.decode('utf-8').splitlines()]
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(req.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(rows))
+        self.assertTrue(all(row['category'] == 2 for row in rows))
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+
+    def test_export_questions_csv_gzip(self):
+        req = self.client().get('/api/questions/export?format=csv&difficulty=4', headers={'Accept-Encoding' : 'gzip'})
+        lines = gzip.decompress(req.data).decode('utf-8').splitlines()
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(req.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(lines[0], 'id,question,answer,difficulty,category')
+        self.assertTrue(len(lines) > 1)
+
+        req = self.client().get('/api/questions/export?format=csv&difficulty=4', headers={'Accept-Encoding' : 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', req.headers)
+        self.assertTrue(req.data.startswith(b'id,question'))
+
+    def test_400_export_questions(self):
+        req = self.client().get('/api/questions/export?format=xml')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_422_delete_questions(self):
         req = self.client().delete('/api/questions/0')
         data = json.loads(req.data)
@@ -118,6 +605,71 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unprocessable')
 
+    def test_batch_questions(self):
+        with self.app.app_context():
+            first = Question('Batch one?', 'One', 1, 1)
+            first.insert()
+            second = Question('Batch two?', 'Two', 1, 2)
+            second.insert()
+            firstId, secondId = first.id, second.id
+
+        req = self.client().post('/api/questions/batch', json={'operations' : [
+            # invalid, it doesn't keep the delete below from using the id
+            {'op' : 'update', 'id' : firstId, 'colour' : 'red'},
+            {'op' : 'delete', 'id' : firstId},
+            {'op' : 'update', 'id' : secondId, 'category' : 2, 'difficulty' : 5},
+            {'op' : 'delete', 'id' : 0},
+            {'op' : 'update', 'id' : secondId, 'difficulty' : 9},
+            {'op' : 'rename', 'id' : secondId},
+        ]})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual((data['deleted'], data['updated'], data['failed']), (1, 1, 4))
+        self.assertEqual([result['status'] for result in data['results']],
+                         ['invalid', 'deleted', 'updated', 'not_found', 'invalid', 'invalid'])
+        with self.app.app_context():
+            self.assertIsNone(db.session.get(Question, firstId))
+            updated = db.session.get(Question, secondId)
+            self.assertEqual((updated.category, updated.difficulty), (2, 5))
+
+        req = self.client().get('/api/categories/2/questions?after={}'.format(secondId - 1))
+        data = json.loads(req.data)
+        self.assertEqual(data['questions'][0]['id'], secondId)
+
+    def test_batch_questions_writes_changed_fields(self):
+        updates = []
+
+        def record(connection, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE questions'):
+                updates.append(statement)
+
+        with self.app.app_context():
+            question = Question('Batch three?', 'Three', 1, 1)
+            question.insert()
+            questionId = question.id
+        event.listen(self.plan_engine(), 'before_cursor_execute', record)
+        try:
+            req = self.client().post('/api/questions/batch', json={'operations' : [
+                {'op' : 'update', 'id' : questionId, 'difficulty' : 4},
+            ]})
+        finally:
+            event.remove(self.plan_engine(), 'before_cursor_execute', record)
+
+        self.assertEqual(json.loads(req.data)['updated'], 1)
+        # a concurrent edit of the answer or the category is not overwritten
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('answer', updates[0])
+        self.assertNotIn('category', updates[0])
+
+    def test_400_batch_questions(self):
+        req = self.client().post('/api/questions/batch', json={'operations' : []})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_get_categories(self):
         req = self.client().get('/api/categories')
         data = json.loads(req.data)
@@ -126,6 +678,174 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['categories']))
 
+    def test_search_cache(self):
+        req = self.client().post('/api/questions', json={'searchTerm' : 'Title'})
+        total = json.loads(req.data)['total_questions']
+        hits = search_cache.hits
+        req = self.client().post('/api/questions', json={'searchTerm' : '  title '})
+        self.assertEqual(search_cache.hits, hits + 1)
+        self.assertEqual(json.loads(req.data)['total_questions'], total)
+
+        with self.app.app_context():
+            question = Question('Which title is cached?', 'None', 1, 1)
+            question.insert()
+        req = self.client().post('/api/questions', json={'searchTerm' : 'title'})
+        data = json.loads(req.data)
+
+        self.assertEqual(data['total_questions'], total + 1)
+        self.assertTrue(search_cache.stats()['entries'] >= 1)
+
+    def test_search_cache_evicts_least_recently_used(self):
+        cache = SearchCache(max_entries=2)
+        search = lambda term, limit, offset, answers: ([{'question' : term}], 1)
+        cache.get('a', 10, 0, False, search)
+        cache.get('b', 10, 0, False, search)
+        cache.get('A', 10, 0, False, search)
+        cache.get('c', 10, 0, False, search)
+
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(sorted(key[0] for key in cache._entries), ['a', 'c'])
+
+    def test_compressed_responses(self):
+        plain = self.client().get('/api/questions?page=1')
+        req = self.client().get('/api/questions?page=1', headers={'Accept-Encoding' : 'gzip'})
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(req.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', req.headers['Vary'])
+        self.assertEqual(gzip.decompress(req.data), plain.data)
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        hits = response_cache.hits
+        req = self.client().get('/api/questions?page=1', headers={'Accept-Encoding' : 'br;q=0, gzip'})
+        self.assertEqual(response_cache.hits, hits + 1)
+        self.assertEqual(gzip.decompress(req.data), plain.data)
+
+        # under COMPRESSION_MIN_SIZE the body is sent as is
+        req = self.client().get('/api/categories/2/questions?fields=id', headers={'Accept-Encoding' : 'gzip'})
+        self.assertNotIn('Content-Encoding', req.headers)
+        self.assertEqual(json.loads(req.data)['current_category'], 2)
+
+    def test_response_cache_invalidated_on_write(self):
+        req = self.client().post('/api/questions?page=1', json={'searchTerm' : ''}, headers={'Accept-Encoding' : 'gzip'})
+        total = json.loads(gzip.decompress(req.data))['total_questions']
+        hits = response_cache.hits
+        self.client().post('/api/questions?page=1', json={'searchTerm' : ' '}, headers={'Accept-Encoding' : 'gzip'})
+        self.assertEqual(response_cache.hits, hits + 1)
+
+        with self.app.app_context():
+            question = Question('Is this body cached?', 'No', 1, 1)
+            question.insert()
+        req = self.client().post('/api/questions?page=1', json={'searchTerm' : ''}, headers={'Accept-Encoding' : 'gzip'})
+
+        self.assertEqual(json.loads(gzip.decompress(req.data))['total_questions'], total + 1)
+        self.assertEqual(response_cache.hits, hits + 1)
+
+    def test_get_categories_with_counts(self):
+        req = self.client().get('/api/categories?with_counts=1')
+        data = json.loads(req.data)
+        with self.app.app_context():
+            scienceCount = Question.query.filter(Question.category==1).count()
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(set(data['counts']), set(data['categories']))
+        self.assertEqual(data['counts']['1'], scienceCount)
+
+        with self.app.app_context():
+            question = Question('Counted?', 'Yes', 1, 3)
+            question.insert()
+            question.category = 2
+            question.update()
+        req = self.client().get('/api/categories?with_counts=1')
+        data = json.loads(req.data)
+        self.assertEqual(data['counts']['1'], scienceCount)
+
+        req = self.client().get('/api/categories/2/questions?difficulty=3')
+        data = json.loads(req.data)
+        with self.app.app_context():
+            self.assertEqual(data['total_questions'], Question.query.filter(Question.category==2, Question.difficulty==3).count())
+
+    def test_categories_cache_invalidated_on_write(self):
+        self.client().get('/api/categories')
+        hits = category_cache.hits
+        self.client().get('/api/categories')
+        self.assertEqual(category_cache.hits, hits + 1)
+
+        with self.app.app_context():
+            category = Category(type='Music')
+            db.session.add(category)
+            db.session.commit()
+            category_id = category.id
+        req = self.client().get('/api/categories')
+        data = json.loads(req.data)
+
+        self.assertEqual(data['categories'][str(category_id)], 'Music')
+
+        with self.app.app_context():
+            db.session.delete(db.session.get(Category, category_id))
+            db.session.commit()
+        req = self.client().get('/api/categories')
+        data = json.loads(req.data)
+
+        self.assertNotIn(str(category_id), data['categories'])
+
+    def test_conditional_get(self):
+        req = self.client().get('/api/questions?page=1')
+        etag = req.headers['ETag']
+
+        self.assertEqual(req.status_code, 200)
+        self.assertTrue(req.headers['Last-Modified'])
+        self.assertIn('must-revalidate', req.headers['Cache-Control'])
+
+        req = self.client().get('/api/questions?page=1', headers={'If-None-Match' : etag})
+
+        self.assertEqual(req.status_code, 304)
+        self.assertEqual(req.data, b'')
+
+        req = self.client().get('/api/questions?page=2', headers={'If-None-Match' : etag})
+
+        self.assertEqual(req.status_code, 200)
+
+    def test_conditional_get_after_write(self):
+        req = self.client().get('/api/categories/2/questions')
+        etag = req.headers['ETag']
+
+        with self.app.app_context():
+            question = Question(question='Who painted The Starry Night?', answer='Van Gogh', category=2, difficulty=2)
+            question.insert()
+        req = self.client().get('/api/categories/2/questions', headers={'If-None-Match' : etag})
+
+        self.assertEqual(req.status_code, 200)
+        self.assertNotEqual(req.headers['ETag'], etag)
+
+    def test_conditional_get_expires(self):
+        # another worker may have written: the validators only hold for HTTP_CACHE_TTL
+        # a window start, in the future of the last write
+        now = (int(time.time()) // 60 + 10) * 60
+        with mock.patch('flaskr.http_cache.time.time', return_value=now):
+            req = self.client().get('/api/categories')
+        etag, last_modified = req.headers['ETag'], req.headers['Last-Modified']
+        with mock.patch('flaskr.http_cache.time.time', return_value=now + 30):
+            req = self.client().get('/api/categories', headers={'If-None-Match' : etag})
+            self.assertEqual(req.status_code, 304)
+        with mock.patch('flaskr.http_cache.time.time', return_value=now + 60):
+            req = self.client().get('/api/categories', headers={'If-None-Match' : etag})
+            self.assertEqual(req.status_code, 200)
+            req = self.client().get('/api/categories', headers={'If-Modified-Since' : last_modified})
+            self.assertEqual(req.status_code, 200)
+
+    def test_conditional_get_missing_category(self):
+        # a date in the future is newer than any version, but there is nothing to keep
+        since = 'Fri, 01 Jan 2100 00:00:00 GMT'
+        req = self.client().get('/api/categories/2/questions', headers={'If-Modified-Since' : since})
+        self.assertEqual(req.status_code, 304)
+        req = self.client().get('/api/categories/999/questions', headers={'If-Modified-Since' : since})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 404)
+        self.assertEqual(data['message'], 'resource not found')
+
     def test_404_categories(self):
         req = self.client().get('/api/categoriess')
         data = json.loads(req.data)
@@ -141,6 +861,66 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(req.status_code, 200)
         self.assertEqual(data['success'], True)
         
+    def test_import_questions(self):
+        total = json.loads(self.client().get('/api/categories/1/questions').data)['total_questions']
+        with self.app.app_context():
+            size = question_index.size(1)
+        lines = [
+            json.dumps({'question' : 'What is the chemical symbol for gold?', 'answer' : 'Au', 'difficulty' : 2, 'category' : 1}),
+            json.dumps({'question' : 'Who painted the Sistine Chapel ceiling?', 'answer' : 'Michelangelo', 'category' : 2}),
+            json.dumps({'question' : 'Missing answer', 'category' : 1}),
+            json.dumps({'question' : 'Unknown category?', 'answer' : 'None', 'category' : 4550044}),
+            'not json',
+        ]
+        req = self.client().post('/api/questions/import', data='\n'.join(lines), content_type='application/x-ndjson')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['failed'], 3)
+        self.assertEqual([error['line'] for error in data['errors']], [3, 4, 5])
+        # the counters and the quiz index follow the import
+        req = self.client().get('/api/categories/1/questions')
+        self.assertEqual(json.loads(req.data)['total_questions'], total + 1)
+        with self.app.app_context():
+            self.assertEqual(question_index.size(1), size + 1)
+
+    def test_import_questions_csv(self):
+        body = 'question,answer,difficulty,category\n"What is the capital of Italy?",Rome,1,3\n'
+        req = self.client().post('/api/questions/import', data=body, content_type='text/csv')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['failed'], 0)
+
+    def test_400_import_questions(self):
+        req = self.client().post('/api/questions/import?format=xml', data='<questions/>')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_400_import_questions_not_utf8(self):
+        total = json.loads(self.client().get('/api/questions').data)['total_questions']
+        body = json.dumps({'question' : 'Imported before the bad bytes?', 'answer' : 'No', 'category' : 1}).encode() + b'\n\xff\xfe\n'
+        req = self.client().post('/api/questions/import', data=body, content_type='application/x-ndjson')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(json.loads(self.client().get('/api/questions').data)['total_questions'], total)
+
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as file:
+            file.write(body)
+            file.flush()
+            result = self.app.test_cli_runner().invoke(args=['import-questions', file.name])
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('is not utf-8', result.output)
+
     def test_422_create_question(self):
         req = self.client().post('/api/questions', json={'id' : 23, 'question' : 'Whose autobiography is entitled \'I Know Why the Caged Bird Sings\'?', 'answer' : 'Maya Angelou', 'difficulty' : 2, 'category' : 4})
         data = json.loads(req.data)
@@ -170,6 +950,88 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(len([data['question']]), 1)
 
+    def test_get_next_question_skips_previous(self):
+        with self.app.app_context():
+            previous_questions = Question.query.order_by(Question.id).filter(Question.category==2).all()
+            questions = [previous_question.id for previous_question in previous_questions]
+        req = self.client().post('/api/quizzes', json={'previous_questions' : questions[1:], 'quiz_category' : {'id' : '2'}})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['question']['id'], questions[0])
+        self.assertEqual(data['total_questions'], min(len(questions), 5))
+
+        req = self.client().post('/api/quizzes', json={'previous_questions' : questions, 'quiz_category' : {'id' : 2}})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['question'], False)
+
+    def test_prefetch_quiz_questions(self):
+        with self.app.app_context():
+            questions = [question.id for question in Question.query.filter(Question.category==2).all()]
+        req = self.client().post('/api/quizzes', json={'previous_questions' : questions[0:1], 'quiz_category' : {'id' : 2}, 'count' : 5})
+        data = json.loads(req.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(len(ids), min(len(questions) - 1, 5))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotIn(questions[0], ids)
+        self.assertEqual(data['question'], data['questions'][0])
+        self.assertEqual(data['total_questions'], min(len(questions), 5))
+
+    def test_400_prefetch_quiz_questions(self):
+        req = self.client().post('/api/quizzes', json={'previous_questions' : [], 'quiz_category' : {'id' : 2}, 'count' : 50})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_quiz_index_follows_inserts_and_deletes(self):
+        with self.app.app_context():
+            question = Question(question='Which planet is known as the red planet?', answer='Mars', category=1, difficulty=1)
+            question.insert()
+            question_id = question.id
+            others = [other.id for other in Question.query.filter(Question.id != question_id).all()]
+        req = self.client().post('/api/quizzes', json={'previous_questions' : others, 'quiz_category' : {'id' : 0}})
+        data = json.loads(req.data)
+
+        self.assertEqual(data['question']['id'], question_id)
+
+        with self.app.app_context():
+            db.session.get(Question, question_id).delete()
+        req = self.client().post('/api/quizzes', json={'previous_questions' : others, 'quiz_category' : {'id' : 0}})
+        data = json.loads(req.data)
+
+        self.assertEqual(data['question'], False)
+
+    def test_quiz_session(self):
+        req = self.client().post('/api/quizzes/sessions', json={'quiz_category' : {'id' : 2}})
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['token'])
+
+        token = data['token']
+        asked = []
+        for _ in range(data['total_questions']):
+            req = self.client().post('/api/quizzes/sessions/{}/next'.format(token))
+            question = json.loads(req.data)['question']
+            self.assertEqual(question['category'], 2)
+            asked.append(question['id'])
+
+        self.assertEqual(len(set(asked)), len(asked))
+
+    def test_404_quiz_session(self):
+        req = self.client().post('/api/quizzes/sessions/notatoken/next')
+        data = json.loads(req.data)
+
+        self.assertEqual(req.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
     def test_404_get_next_question(self):
         with self.app.app_context():
             previous_questions = Question.query.order_by(Question.id).filter(Question.category==2).all()
@@ -194,6 +1056,106 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(len([data['question']]), 1)
 
+    def test_snapshot_mode(self):
+        urls = ['/api/categories?with_counts=1', '/api/questions?page=2', '/api/questions?after=10&limit=3',
+                '/api/categories/2/questions?sort=-difficulty', '/api/categories/1/questions?after=30&sort=-id',
+                '/api/questions/export?category=3']
+        fromDatabase = [self.client().get(url).data for url in urls]
+        search = self.client().post('/api/questions', json={'searchTerm' : 'the', 'searchAnswers' : True}).data
+
+        # built here, without the background thread rebuilding under the test
+        with self.app.app_context():
+            question_snapshot.rebuild()
+        try:
+            self.assertIsNotNone(question_snapshot.get())
+            self.assertEqual([self.client().get(url).data for url in urls], fromDatabase)
+            self.assertEqual(json.loads(self.client().post('/api/questions', json={'searchTerm' : 'the', 'searchAnswers' : True}).data)['total_questions'],
+                             json.loads(search)['total_questions'])
+
+            etag = self.client().get('/api/questions').headers['ETag']
+            self.client().post('/api/questions', json={'question' : 'Snapshot?', 'answer' : 'Yes', 'category' : 1, 'difficulty' : 1})
+            with self.app.app_context():
+                question_snapshot.rebuild()
+            req = self.client().get('/api/questions')
+            data = json.loads(req.data)
+
+            self.assertNotEqual(req.headers['ETag'], etag)
+            self.assertEqual(data['total_questions'], json.loads(fromDatabase[1])['total_questions'] + 1)
+        finally:
+            question_snapshot.stop()
+
+    def test_snapshot_keeps_any_difficulty(self):
+        # difficulty isn't validated on create, the snapshot has to hold whatever was stored
+        self.client().post('/api/questions', json={'question' : 'Hard?', 'answer' : 'Very', 'category' : 1, 'difficulty' : 300})
+        self.client().post('/api/questions', json={'question' : 'Unrated?', 'answer' : 'Yes', 'category' : 1, 'difficulty' : None})
+        urls = ['/api/categories/1/questions?difficulty=300', '/api/categories/1/questions?difficulty=0',
+                '/api/categories/1/questions?sort=difficulty', '/api/questions/export?category=1']
+        fromDatabase = [self.client().get(url).data for url in urls]
+
+        with self.app.app_context():
+            question_snapshot.rebuild()
+        try:
+            self.assertIsNotNone(question_snapshot.get())
+            self.assertEqual([self.client().get(url).data for url in urls], fromDatabase)
+            self.assertEqual(json.loads(fromDatabase[0])['questions'][0]['difficulty'], 300)
+            self.assertEqual(json.loads(fromDatabase[1])['questions'], [])
+            self.assertIsNone(json.loads(fromDatabase[2])['questions'][0]['difficulty'])
+        finally:
+            question_snapshot.stop()
+
+    def test_migrations_are_idempotent(self):
+        with self.app.app_context():
+            self.assertEqual(upgrade(db.engine), [])
+            index_names = [index['name'] for index in db.inspect(db.engine).get_indexes('questions')]
+
+        self.assertIn('ix_questions_category_id', index_names)
+        self.assertIn('ix_questions_category_difficulty_id', index_names)
+
+    def test_hot_paths_use_indexes(self):
+        with self.app.app_context():
+            with QueryPlanCheck(self.plan_engine()) as check:
+                self.client().get('/api/questions?page=2')
+                self.client().get('/api/questions?after=5&limit=5')
+                self.client().get('/api/categories/1/questions?difficulty=2&sort=-difficulty')
+                self.client().get('/api/categories/1/questions?after=5')
+                self.client().post('/api/questions', json={'searchTerm': 'title'})
+                self.client().post('/api/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 1}})
+            scans = check.full_scans()
+
+        self.assertTrue(check.statements)
+        self.assertEqual(scans, [])
+
+    def test_plan_check_reports_scans(self):
+        with self.app.app_context():
+            with QueryPlanCheck(db.engine) as check, self.app.test_request_context():
+                db.session.execute(db.select(Question.id).where(Question.answer == 'Apollo 13')).all()
+            scans = check.full_scans()
+        if self.plan_check is not None:
+            # the scan is on purpose, don't fail under EXPLAIN_QUERIES=1
+            self.plan_check.statements = []
+
+        self.assertEqual(len(scans), 1)
+
+    def test_plan_check_reports_missing_index(self):
+        with self.app.app_context():
+            # rolled back with the test transaction
+            db.session.execute(db.text('DROP INDEX ix_questions_category_id'))
+            with QueryPlanCheck(self.plan_engine()) as check:
+                self.client().get('/api/categories/1/questions')
+            scans = check.full_scans()
+            with self.app.test_request_context():
+                # a filtered scan is not saved by its LIMIT
+                db.session.execute(db.text('DROP INDEX ix_questions_category_difficulty_id'))
+                with QueryPlanCheck(db.engine) as check:
+                    db.session.execute(db.select(Question.id).where(Question.category == 3)
+                                       .order_by(Question.id).limit(11)).all()
+                filtered = check.full_scans()
+        if self.plan_check is not None:
+            self.plan_check.statements = []
+
+        self.assertIn('getQuestionsByCategory', [endpoint for endpoint, statement, line in scans])
+        self.assertEqual(len(filtered), 1)
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file